@@ -0,0 +1,370 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Micro-benchmarks of PyBot's hot paths, run against synthetic statuses and
+the offline simulated backend. From the repository's root:
+
+    python -m benchmarks.run                      # run and report
+    python -m benchmarks.run --save baseline.json # ...and store as baseline
+    python -m benchmarks.run --baseline baseline.json
+
+Compared to a baseline, any benchmark whose throughput drops, or whose
+allocations grow, by more than the tolerance is reported as a regression,
+and the exit status is 1.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from pybot import PyBot
+from pybot.simulator import SimulatedTwitter
+
+class BenchBot(PyBot):
+    """
+    Bot with every built-in action off, quiet logging, no rate limit
+    budgets and no seen-tweet cache, so that only the code being measured
+    does any work.
+    """
+
+    def bot_init(self):
+        self.config['bot_name'] = 'benchbot'
+        self.config['logging_level'] = logging.WARNING
+        self.config['api_rate_limits'] = {}
+        self.config['seen_cache_size'] = 0
+        self.config['autofav_keywords'] = ['python', 'coffee']
+        self.config['blacklist'] = ['user%s' % i for i in range(1000, 1100)]
+        self.config['reply_followers_only'] = False
+
+    def on_timeline(self, tweet, prefix):
+        pass
+
+    def on_mention(self, tweet, prefix):
+        pass
+
+    def on_search(self, tweet):
+        pass
+
+    def on_follow(self, friend):
+        pass
+
+    def on_tweet(self):
+        pass
+
+    def create_favorite(self, tweet):
+        return True
+
+def _bot(**config):
+    """
+    Makes a BenchBot on a fresh simulated backend.
+    """
+    sim = SimulatedTwitter(latency = 0, rate_limits = {}, seed = 0)
+    bot = BenchBot(api_client = sim, stream_factory = sim.stream)
+    bot.config.update(config)
+    return bot, sim
+
+def _statuses(sim, n, text = None):
+    """
+    Makes `n` synthetic tweepy.Status objects.
+    """
+    rng = sim._random
+    return [sim._status(rng.randrange(1000, 11000), 'user%s' % rng.randrange(1000, 11000),
+        text if text is not None else sim._text()) for _ in range(n)]
+
+# # # # # # # # # # # # # # # # # # # # # # #
+#               The benchmarks.             #
+# # # # # # # # # # # # # # # # # # # # # # #
+
+# Each benchmark sets up its inputs, then returns a function that runs one
+# round, the number of operations in a round, and a function that readies
+# the inputs for the next round (or None), which runs untimed before each.
+# Input sizes are multiplied by `scale`.
+
+def bench_on_status(scale = 1):
+    """
+    Stream ingest: 4 threads feeding statuses into on_status at once.
+    """
+    bot, sim = _bot()
+    statuses = _statuses(sim, int(5000 * scale))
+    threads = 4
+
+    def round():
+        workers = [threading.Thread(target = lambda: [bot.on_status(s) for s in statuses]) for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    return round, threads * len(statuses), bot.drain_buffer
+
+def bench_drain(scale = 1):
+    """
+    _handle_search: draining the buffer and running every tweet past the
+    blacklist and autofav keywords.
+    """
+    bot, sim = _bot()
+    bot.stream.running = True
+    statuses = _statuses(sim, int(20000 * scale))
+
+    def fill():
+        for s in statuses:
+            bot.on_status(s)
+    return bot._handle_search, len(statuses), fill
+
+def bench_mention_prefix(scale = 1):
+    """
+    _mention_prefix on tweets mentioning a dozen users each.
+    """
+    bot, sim = _bot()
+    text = ' '.join('@user%s hello' % i for i in range(1090, 1102))
+    tweets = _statuses(sim, int(2000 * scale), text)
+
+    def round():
+        for t in tweets:
+            bot._mention_prefix(t)
+    return round, len(tweets), None
+
+def bench_timeline(scale = 1):
+    """
+    _handle_timeline: filtering a page of 500 tweets for self-mentions,
+    blacklisted authors and autofav keywords.
+    """
+    bot, sim = _bot()
+    page = _statuses(sim, int(500 * scale))
+    bot.api.api = _Timeline(page)
+
+    def round():
+        bot.state['last_timeline_id'] = 1
+        bot._handle_timeline()
+    return round, len(page), None
+
+def bench_save_state(scale = 1):
+    """
+    _save_state with a million followers and 100,000 friends.
+    """
+    bot, sim = _bot()
+    bot.state['followers'] = bot._id_set(range(10 ** 9, 10 ** 9 + int(10 ** 6 * scale)))
+    bot.state['friends'] = bot._id_set(range(2 * 10 ** 9, 2 * 10 ** 9 + int(10 ** 5 * scale)))
+
+    def round():
+        bot.state.touch('followers')
+        bot._save_state(force = True)
+    return round, 1, None
+
+def bench_scheduler(scale = 1):
+    """
+    run(): dispatching 1,000 custom callbacks that are always due.
+    """
+    bot, sim = _bot()
+    runs = [0]
+    total = int(20000 * scale)
+
+    def callback():
+        runs[0] += 1
+        if runs[0] >= total:
+            bot.running = False
+    for _ in range(int(1000 * scale)):
+        bot.register_custom_callback(callback, 0)
+    bot.graph_ready.set()
+    bot.state['graph_time'] = time.time()
+
+    def round():
+        runs[0] = 0
+        bot.run()
+    return round, total, None
+
+class _Timeline(object):
+    """
+    API stand-in that returns the same home timeline page every time.
+    """
+
+    def __init__(self, page):
+        self.page = page
+
+    def home_timeline(self, **kwargs):
+        return self.page
+
+BENCHMARKS = [
+    ('on_status', bench_on_status),
+    ('drain', bench_drain),
+    ('mention_prefix', bench_mention_prefix),
+    ('timeline', bench_timeline),
+    ('save_state', bench_save_state),
+    ('scheduler', bench_scheduler),
+]
+
+# # # # # # # # # # # # # # # # # # # # # # #
+#              Running and reporting.       #
+# # # # # # # # # # # # # # # # # # # # # # #
+
+def count_allocations(round):
+    """
+    Runs `round` with every bytecode instruction traced, in this thread and
+    in any threads it starts.
+
+    Returns
+    -------
+    The number of memory blocks allocated during the round: the sum of the
+    increases in sys.getallocatedblocks() from one instruction to the next,
+    less the frame object that tracing creates for each call. Blocks both
+    allocated and freed within one instruction, such as inside a C call,
+    are not seen, so this is a lower bound.
+    """
+    get = sys.getallocatedblocks
+    state = [get(), 0]  # Last reading, blocks allocated.
+
+    def tracer(frame, event, arg):
+        n = get()
+        if n > state[0]:
+            state[1] += n - state[0]
+        if event == 'call':
+            frame.f_trace_opcodes = True
+            state[1] -= 1
+        state[0] = n
+        return tracer
+
+    threading.settrace(tracer)
+    sys.settrace(tracer)
+    try:
+        (lambda: round())()  # A call, so the round's own frame is traced.
+    finally:
+        sys.settrace(None)
+        threading.settrace(None)
+    return max(state[1], 0)
+
+# Tracing every instruction is slow, so allocations are counted on inputs
+# scaled down by this much.
+ALLOCATION_SCALE = 0.05
+
+def measure(setup, repeat = 5):
+    """
+    Runs a benchmark, readying its inputs untimed before every round.
+
+    Returns
+    -------
+    Dict with the best `ops_per_sec` over `repeat` rounds, the peak traced
+    memory in bytes of one more round under tracemalloc (`peak_bytes`),
+    and the number of memory blocks allocated per operation in a traced
+    round on scaled-down inputs (`allocs_per_op`).
+    """
+    round, ops, prepare = setup()
+    if prepare is None:
+        prepare = lambda: None
+    prepare()
+    round()  # Warm up.
+
+    best = None
+    for _ in range(repeat):
+        prepare()
+        gc.collect()
+        start = time.perf_counter()
+        round()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    prepare()
+    gc.collect()
+    tracemalloc.start()
+    round()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    round = prepare = None
+
+    small, small_ops, small_prepare = setup(scale = ALLOCATION_SCALE)
+    if small_prepare is None:
+        small_prepare = lambda: None
+    small_prepare()
+    small()  # Warm up.
+    small_prepare()
+    gc.collect()
+    allocs = count_allocations(small)
+
+    return {
+        'ops_per_sec': ops / best,
+        'allocs_per_op': allocs / float(small_ops),
+        'peak_bytes': peak,
+    }
+
+def compare(results, baseline, tolerance):
+    """
+    Lists the regressions in `results` relative to `baseline`.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - tolerance):
+            regressions.append("%s: %.0f ops/sec, down from %.0f." % (name, result['ops_per_sec'], base['ops_per_sec']))
+        if 'allocs_per_op' in base and result['allocs_per_op'] > max(base['allocs_per_op'] * (1 + tolerance), base['allocs_per_op'] + 0.01):
+            regressions.append("%s: %.3f allocs/op, up from %.3f." % (name, result['allocs_per_op'], base['allocs_per_op']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks PyBot's hot paths.",
+        epilog = "Example: python -m benchmarks.run --baseline baseline.json")
+    parser.add_argument("names", nargs = "*",
+        help = "Benchmarks to run. [DEFAULT: all of them]")
+    parser.add_argument("--repeat", type = int, default = 5,
+        help = "Number of timed rounds per benchmark; the best counts. [DEFAULT: 5]")
+    parser.add_argument("--baseline",
+        help = "JSON file of earlier results to compare against.")
+    parser.add_argument("--save",
+        help = "JSON file to write the results to.")
+    parser.add_argument("--tolerance", type = float, default = 0.1,
+        help = "Fraction by which results may be worse than the baseline. [DEFAULT: 0.1]")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    save = os.path.abspath(args.save) if args.save is not None else None
+
+    # Bots write their state and logs to the working directory.
+    cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix = 'pybot-bench-')
+    os.chdir(workdir)
+    results = {}
+    try:
+        for name, setup in BENCHMARKS:
+            if len(args.names) > 0 and name not in args.names:
+                continue
+            results[name] = result = measure(setup, args.repeat)
+            line = "%-16s %12.0f ops/sec %10.3f allocs/op %10.1f KiB peak" % (name,
+                result['ops_per_sec'], result['allocs_per_op'], result['peak_bytes'] / 1024.0)
+            if name in baseline:
+                line += "  (%+.1f%%)" % (100.0 * (result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1))
+            print(line)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors = True)
+
+    if save is not None:
+        with open(save, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for r in regressions:
+        print("REGRESSION %s" % r)
+    sys.exit(1 if len(regressions) > 0 else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+class MarkovModel(object):
+    """
+    Read-only, array-backed 2nd-order Markov chain, compiled from a
+    TrigramModel's counts.
+
+    Words are interned to integer IDs. Each pair of words (w1, w2) becomes
+    the int64 key w1 * V + w2, V being the vocabulary size; `keys` holds
+    them sorted, and the successors of `keys[i]` are
+    `successors[indptr[i]:indptr[i + 1]]`. `cumweights` is the running
+    total of the successors' weights over the whole array, so a successor
+    is picked, for many chains at once, with a single searchsorted.
+
+    The arrays can be saved to a directory and memory-mapped back from it,
+    so several bot processes can share one copy of the model. Each save
+    goes to a new version subdirectory, and the file CURRENT names the
+    latest complete one, so a reader never mixes arrays from two saves.
+    """
+
+    ARRAYS = ('keys', 'indptr', 'successors', 'cumweights')
+
+    def __init__(self, vocab, keys, indptr, successors, cumweights, start, end):
+        """
+        Parameters
+        ----------
+        vocab : list of strings
+            Word for each ID.
+        keys, indptr, successors, cumweights : numpy arrays
+            The transitions, as described above.
+        start : tuple of strings
+            The two tokens each tweet starts with.
+        end : string
+            The token each tweet ends with.
+        """
+        self.vocab = vocab
+        self.keys = keys
+        self.indptr = indptr
+        self.successors = successors
+        self.cumweights = cumweights
+        self.start = tuple(start)
+        self.end = end
+
+        ids = {w: i for i, w in enumerate(vocab)}
+        self._start_ids = tuple(ids.get(w, -1) for w in self.start)
+        self._end_id = ids.get(end, -1)
+        self._lengths = np.array([len(w) for w in vocab], dtype = np.int64)
+
+    @classmethod
+    def from_counts(cls, counts, start, end):
+        """
+        Compiles a TrigramModel's `data['counts']`.
+        """
+        ids = {}
+        vocab = []
+        def intern(w):
+            i = ids.get(w)
+            if i is None:
+                i = ids[w] = len(vocab)
+                vocab.append(w)
+            return i
+        for w in tuple(start) + (end,):
+            intern(w)
+        pairs = [(intern(w1), intern(w2), successors) for (w1, w2), successors in counts.items()]
+        for _, _, successors in pairs:
+            for w in successors:
+                intern(w)
+
+        V = len(vocab)
+        rows = sorted((w1 * V + w2, successors) for w1, w2, successors in pairs)
+        keys = np.fromiter((k for k, _ in rows), dtype = np.int64, count = len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype = np.int64)
+        indptr[1:] = np.cumsum([len(s) for _, s in rows])
+        successors = np.fromiter((ids[w] for _, s in rows for w in s), dtype = np.int32, count = indptr[-1])
+        weights = np.fromiter((c for _, s in rows for c in s.values()), dtype = np.float64, count = indptr[-1])
+        return cls(vocab, keys, indptr, successors, np.cumsum(weights), start, end)
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        """
+        Loads the latest model saved to `path` with `save`, memory-mapping
+        its arrays unless `mmap` is False.
+        """
+        with open(os.path.join(path, 'CURRENT')) as f:
+            path = os.path.join(path, f.read().strip())
+        with open(os.path.join(path, 'vocab.json')) as f:
+            meta = json.load(f)
+        arrays = [np.load(os.path.join(path, '%s.npy' % name), mmap_mode = 'r' if mmap else None)
+            for name in cls.ARRAYS]
+        return cls(meta['vocab'], *arrays, start = meta['start'], end = meta['end'])
+
+    def save(self, path):
+        """
+        Writes the model to a new version subdirectory of `path`, then
+        atomically points CURRENT at it. The previous version is kept, for
+        readers still using it; older ones are deleted.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        version = tempfile.mkdtemp(prefix = 'v%d-' % time.time(), dir = path)
+        for name in self.ARRAYS:
+            np.save(os.path.join(version, '%s.npy' % name), getattr(self, name))
+        with open(os.path.join(version, 'vocab.json'), 'w') as f:
+            json.dump({'vocab': self.vocab, 'start': self.start, 'end': self.end}, f)
+
+        current = os.path.join(path, 'CURRENT')
+        previous = None
+        if os.path.exists(current):
+            with open(current) as f:
+                previous = f.read().strip()
+        with open(current + '.tmp', 'w') as f:
+            f.write(os.path.basename(version))
+        os.replace(current + '.tmp', current)
+
+        keep = (os.path.basename(version), previous)
+        for name in os.listdir(path):
+            if name.startswith('v') and name not in keep and os.path.isdir(os.path.join(path, name)):
+                shutil.rmtree(os.path.join(path, name), ignore_errors = True)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        """
+        Size of the transition arrays, in bytes.
+        """
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def generate(self, n = 1, max_length = 140):
+        """
+        Samples `n` tweets at once, advancing every chain a word at a time.
+
+        Returns
+        -------
+        List of `n` strings. They're empty if the model is.
+        """
+        words = [[] for _ in range(n)]
+        if len(self.keys) == 0 or min(self._start_ids) < 0:
+            return [''] * n
+
+        V = len(self.vocab)
+        prev = np.full(n, self._start_ids[0], dtype = np.int64)
+        cur = np.full(n, self._start_ids[1], dtype = np.int64)
+        length = np.full(n, -1, dtype = np.int64)
+        alive = np.arange(n)
+        while len(alive) > 0:
+            key = prev[alive] * V + cur[alive]
+            row = np.searchsorted(self.keys, key)
+            found = row < len(self.keys)
+            found[found] = self.keys[row[found]] == key[found]
+            alive, row = alive[found], row[found]
+
+            # Pick a successor within each row, in proportion to weight.
+            lo, hi = self.indptr[row], self.indptr[row + 1]
+            base = np.where(lo > 0, self.cumweights[lo - 1], 0)
+            target = base + np.random.random_sample(len(row)) * (self.cumweights[hi - 1] - base)
+            pick = np.minimum(np.searchsorted(self.cumweights, target, side = 'right'), hi - 1)
+            word = self.successors[pick].astype(np.int64)
+
+            new_length = length[alive] + 1 + self._lengths[word]
+            going = (word != self._end_id) & (new_length < max_length)
+            alive, word = alive[going], word[going]
+            length[alive] = new_length[going]
+            for i, w in zip(alive.tolist(), word.tolist()):
+                words[i].append(self.vocab[w])
+            prev[alive] = cur[alive]
+            cur[alive] = word
+        return [' '.join(w) for w in words]
@@ -12,10 +12,11 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import json
 import re
 
 from pybot import PyBot
+from pybot.filters import RetweetFilter
+from pybot.sink import JsonlSink
 
 class Miner(PyBot):
 
@@ -52,6 +53,13 @@ class Miner(PyBot):
         self.config['search_keywords'] = []
         self.config['search_interval'] = 10
 
+        # Only these fields of each streamed tweet are kept in memory.
+        self.config['stream_fields'] += [
+            'coordinates', 'favorite_count', 'retweet_count', 'user.created_at',
+            'user.description', 'user.followers_count', 'user.friends_count',
+            'user.id_str', 'user.statuses_count',
+        ]
+
         #############################
         #                           #
         #   Customize your bot's    #
@@ -61,6 +69,14 @@ class Miner(PyBot):
 
         self.state['buffer'] = []
 
+        # Skip retweets before they're even buffered.
+        self.stream_filters.add(RetweetFilter())
+
+        # Batches the mined tweets and writes them out in the background.
+        # Pass e.g. `hourly = True, compression = 'gzip'` to rotate and
+        # compress the output.
+        self.sink = JsonlSink('tweets.json')
+
     def on_search(self, tweet):
         """
         Handler for responding to public tweets that contain certain keywords,
@@ -73,9 +89,6 @@ class Miner(PyBot):
             this object mimic Twitter's Tweet object:
             https://dev.twitter.com/overview/api/tweets
         """
-        if 'RT @' in tweet.text:
-            return None
-
         # Some filtering and preprocessing.
         text = tweet.text.replace("\n", " ").lower()
         text = re.sub(r"http\S+", "", text)
@@ -95,8 +108,7 @@ class Miner(PyBot):
             'tweet_id': tweet.id_str,
             'in_reply_to_screen_name': tweet.in_reply_to_screen_name,
         }
-        with open("tweets.json", "a") as f:
-            f.write("{}\n".format(json.dumps(d)))
+        self.sink.write(d)
 
     def on_tweet(self):
         pass
@@ -13,10 +13,127 @@ limitations under the License.
 """
 
 import logging
+import os
+import pickle
+import random
+import time
+
 import numpy as np
 
+from markov import MarkovModel
 from pybot import PyBot
 
+class TrigramModel(object):
+    """
+    2nd-order Markov chain over words, updated one tweet at a time.
+
+    Holds, for each pair of consecutive words, a weighted count of each word
+    that followed it. With a `half_life`, older tweets count for less: each
+    new tweet is weighted 2 ** (age / half_life) relative to the model's
+    epoch, and once per half-life every count is scaled back down and the
+    ones that have faded below `min_weight` are forgotten.
+
+    All of the model's data lives in the plain dict `data`, which can be
+    pickled as-is.
+    """
+
+    def __init__(self, data = None, start = ('_START1_', '_START2_'), end = '_STOP_',
+            half_life = 0, min_weight = 0.05):
+        """
+        Parameters
+        ----------
+        data : dict
+            A previous model's `data`, or None to start from scratch.
+        start : tuple of strings
+            The two tokens each tweet is prefixed with.
+        end : string
+            The token each tweet is suffixed with.
+        half_life : float
+            Number of seconds over which a tweet's weight halves, or 0 for
+            no decay.
+        min_weight : float
+            Weight below which counts are dropped when the model decays.
+        """
+        self.data = data if data is not None else {'counts': {}, 'epoch': time.time()}
+        self.start = tuple(start)
+        self.end = end
+        self.half_life = half_life
+        self.min_weight = min_weight
+
+    def __len__(self):
+        return len(self.data['counts'])
+
+    def update(self, text):
+        """
+        Adds the trigrams of one tweet to the model.
+        """
+        weight = 1
+        if self.half_life > 0:
+            age = time.time() - self.data['epoch']
+            if age > self.half_life:
+                self.decay()
+                age = time.time() - self.data['epoch']
+            weight = 2 ** (age / self.half_life)
+
+        tokens = list(self.start) + text.split() + [self.end]
+        counts = self.data['counts']
+        for i in range(len(tokens) - 2):
+            successors = counts.setdefault((tokens[i], tokens[i + 1]), {})
+            successors[tokens[i + 2]] = successors.get(tokens[i + 2], 0) + weight
+
+    def decay(self):
+        """
+        Scales all counts down to the current time, forgetting faded ones.
+        """
+        now = time.time()
+        scale = 2 ** (-(now - self.data['epoch']) / self.half_life)
+        counts = self.data['counts']
+        for key in list(counts):
+            successors = counts[key]
+            for word in list(successors):
+                successors[word] *= scale
+                if successors[word] < self.min_weight:
+                    del successors[word]
+            if len(successors) == 0:
+                del counts[key]
+        self.data['epoch'] = now
+
+    def generate(self, max_length = 140):
+        """
+        Samples a tweet from the model.
+
+        Returns
+        -------
+        The tweet, or None if the model is empty.
+        """
+        counts = self.data['counts']
+        key = self.start
+        if key not in counts:
+            return None
+        words = []
+        length = -1
+        while True:
+            word = _sample(counts[key])
+            if word == self.end or length + 1 + len(word) >= max_length:
+                break
+            words.append(word)
+            length += 1 + len(word)
+            key = (key[1], word)
+            if key not in counts:
+                break
+        return ' '.join(words)
+
+def _sample(successors):
+    """
+    Picks a word from a dict of words to weights, in proportion to weight.
+    """
+    r = random.random() * sum(successors.values())
+    for word, weight in successors.items():
+        r -= weight
+        if r < 0:
+            return word
+    return word
+
 class TrigramBot(PyBot):
 
     def bot_init(self):
@@ -52,6 +169,21 @@ class TrigramBot(PyBot):
         self.config['trigram_s2'] = '_START2_'
         self.config['trigram_end'] = '_STOP_'
 
+        # How quickly the model forgets old tweets: a tweet counts half as
+        # much as one that's this many seconds newer. 0 to never forget.
+        self.config['trigram_half_life'] = 24 * 60 * 60
+
+        # Every `trigram_save_interval` seconds, the model is saved to
+        # `trigram_model_file` (default: "<bot_name>_trigrams.pkl"), apart
+        # from the bot's state, so that it survives restarts. If
+        # `trigram_compiled_path` is set, the model is also compiled into a
+        # compact MarkovModel and saved to that directory, from which other
+        # processes can memory-map it with `MarkovModel.load`; posts are
+        # then sampled from the latest compiled model.
+        self.config['trigram_model_file'] = None
+        self.config['trigram_compiled_path'] = None
+        self.config['trigram_save_interval'] = 15 * 60
+
         # Posts a tweet every 45-ish minutes.
         self.config['normal_mean'] = 45
         self.config['normal_std'] = 5
@@ -61,19 +193,116 @@ class TrigramBot(PyBot):
         # Custom override--sampling the public timeline continuously. This is
         # admittedly a bit of a hack, as this callback will delete itself after
         # it runs only once.
-        self.register_custom_callback(self.start_streaming, 1)
+        self.streaming_callback = self.register_custom_callback(self.start_streaming, 1)
+
+        # The model learns from each tweet as it streams in (see
+        # `on_stream_status`), and is saved by `save_model`.
+        self.model = None
+        self.compiled = None
+        self.register_custom_callback(self.save_model, lambda: self.config['trigram_save_interval'])
+
+    def trigrams(self):
+        """
+        The bot's TrigramModel, loaded from `trigram_model_file` on first
+        use. Only use it while holding `self.state_lock`.
+        """
+        if self.model is None:
+            data = None
+            if os.path.exists(self._model_file()):
+                with open(self._model_file(), 'rb') as f:
+                    data = pickle.load(f)
+            elif 'trigrams' in self.state:
+                # Older versions kept the model in the bot's state; move it
+                # out, into its own file.
+                data = self.state['trigrams']
+                self._write_model(data)
+                del self.state['trigrams']
+            self.model = TrigramModel(data,
+                start = (self.config['trigram_s1'], self.config['trigram_s2']),
+                end = self.config['trigram_end'], half_life = self.config['trigram_half_life'])
+        return self.model
+
+    def on_stream_status(self, status):
+        """
+        Adds each streamed tweet to the model. Returns False, so the tweet
+        itself isn't buffered.
+        """
+        with self.state_lock:
+            self.trigrams().update(status.text.strip())
+        return False
+
+    def save_model(self):
+        """
+        Custom callback: saves the model to `trigram_model_file` and, if
+        `trigram_compiled_path` is set, compiles it into a MarkovModel saved
+        there. The counts are copied a chunk at a time, each under
+        `self.state_lock`, so the stream keeps learning while they're
+        copied, written and compiled.
+        """
+        start = time.time()
+        data = self._copy_model()
+        self._write_model(data)
+        logging.info("Saved %s word pairs in %.3f seconds." % (len(data['counts']), time.time() - start))
+
+        if self.config['trigram_compiled_path'] is not None:
+            self.compile_model(data)
+
+    def compile_model(self, data = None):
+        """
+        Compiles the model (or a copy of its `data`) into a MarkovModel and
+        saves it to `trigram_compiled_path`.
+        """
+        start = time.time()
+        if data is None:
+            data = self._copy_model()
+        model = self.model
+        compiled = MarkovModel.from_counts(data['counts'], model.start, model.end)
+        compiled.save(self.config['trigram_compiled_path'])
+        self.compiled = compiled
+        logging.info("Compiled %s word pairs in %.3f seconds." % (len(compiled), time.time() - start))
+
+    def _copy_model(self):
+        """
+        Copies the model's data, 10000 word pairs at a time.
+        """
+        with self.state_lock:
+            model = self.trigrams()
+            keys = list(model.data['counts'])
+            epoch = model.data['epoch']
+        counts = {}
+        for i in range(0, len(keys), 10000):
+            with self.state_lock:
+                live = model.data['counts']
+                for key in keys[i:i + 10000]:
+                    successors = live.get(key)
+                    if successors is not None:
+                        counts[key] = dict(successors)
+        return {'counts': counts, 'epoch': epoch}
+
+    def _write_model(self, data):
+        """
+        Atomically replaces `trigram_model_file` with a pickle of `data`.
+        """
+        f = self._model_file()
+        with open(f + '.tmp', 'wb') as fp:
+            pickle.dump(data, fp, pickle.HIGHEST_PROTOCOL)
+        os.replace(f + '.tmp', f)
+
+    def _model_file(self):
+        f = self.config['trigram_model_file']
+        return f if f is not None else '%s_trigrams.pkl' % self.config['bot_name']
 
     def start_streaming(self):
         """
         Custom helper to start the streaming process.
         """
         # Start the streaming sample.
-        self.stream.sample(languages = self.config['languages'], async = True)
+        self.stream.sample(languages = self.config['languages'], is_async = True)
         logging.info("Starting the streaming sample.")
 
-        # Delete the custom callbacks, in case this was used to re-start
+        # Delete the custom callback, in case this was used to re-start
         # the streaming API.
-        self.custom_callbacks = []
+        self.cancel_custom_callback(self.streaming_callback)
 
     def on_tweet(self):
         """
@@ -88,52 +317,23 @@ class TrigramBot(PyBot):
         # admittedly a bit of a hack, but until I determine a more elegant way
         # of integrating streaming, this is how it must be.
         if not self.stream.running:
-            self.register_custom_callback(self.start_streaming, 0)
-            return  # Need to wait for the tweet buffer to accumulate.
-
-        # Check out the list of tweets from the buffer.
-        tweets = list(reversed(self.buffer))
-
-        # Clear out the buffer.
-        self.lock.acquire()
-        self.buffer = []
-        self.lock.release()
-
-        # Now let's process the tweets into a glorified 2nd-order Markov chain.
-        model = {}
-        for tweet in tweets:
-            processed = '%s %s %s %s' % (self.config['trigram_s1'],
-                self.config['trigram_s2'], tweet.text.strip(),
-                self.config['trigram_end'])
-            tokens = processed.split()
-            triples = [[tokens[i], tokens[i + 1], tokens[i + 2]] for i in range(len(tokens) - 2)]
-            for w1, w2, w3 in triples:
-                key = (w1, w2)
-                if key in model:
-                    model[key].append(w3)
-                else:
-                    model[key] = [w3]
-
-        # We have the model. Let's sample from it to build a post.
-        post = ""
-        k1 = self.config['trigram_s1']
-        k2 = self.config['trigram_s2']
-        key = (k1, k2)
-
-        # Are there any tweets to process? This can happen if the bot was
-        # stopped and restarted after a sufficiently long wait; the on_tweet
-        # action will trigger immediately, but no tweets will be in the buffer.
-        if key not in model:
-            logging.warn("Model is devoid of tweets! If you didn't just restart your bot, make sure there isn't a problem.")
+            self.streaming_callback = self.register_custom_callback(self.start_streaming, 0)
+            return  # Need to wait for the model to learn some tweets.
+
+        # Sample a post from the model.
+        if self.config['trigram_compiled_path'] is None:
+            with self.state_lock:
+                post = self.trigrams().generate()
+        else:
+            if self.compiled is None:
+                self.compile_model()
+            post = self.compiled.generate()[0]
+
+        # Is there anything in the model? This can happen if the bot was
+        # just started for the first time and no tweets have come in yet.
+        if not post:
+            logging.warn("Model is devoid of tweets! If you didn't just start your bot, make sure there isn't a problem.")
             return
-        nextToken = model[key][np.random.randint(0, len(model[key]))]
-        while nextToken != self.config['trigram_end'] and len('%s %s' % (post, nextToken)) < 140:
-            post = '%s %s' % (post, nextToken)
-            post = post.strip()
-            k1 = k2
-            k2 = nextToken
-            key = (k1, k2)
-            nextToken = model[key][np.random.randint(0, len(model[key]))]
 
         # Post the tweet!
         self.update_status(post)
@@ -1,5 +1,5 @@
 __version__ = '0.3.0'
 __author__ = 'magsol'
 
-from pybot.storage import PickleStorage
-from pybot.pybot import PyBot
+from pybot.storage import PickleStorage, SQLiteStorage
+from pybot.pybot import AsyncPyBot, PyBot
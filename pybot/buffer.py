@@ -0,0 +1,133 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+class RingBuffer(object):
+    """
+    Fixed-capacity FIFO buffer. Appending to a full buffer overwrites the
+    oldest item in O(1), rather than shifting everything down a slot.
+
+    Optionally also caps the total size of the items, in bytes, as reported
+    by the caller on each append; the oldest items are evicted to make room.
+
+    Keeps two running counters: `dropped`, the number of items evicted to
+    make room for new ones, and `peak`, the largest number of items the
+    buffer has held at once. Neither is reset by `clear()`.
+    """
+
+    def __init__(self, capacity, max_bytes = 0):
+        """
+        Parameters
+        ----------
+        capacity : integer
+            Maximum number of items.
+        max_bytes : integer
+            Maximum total size of the items, or 0 for no limit.
+        """
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1, not %s." % capacity)
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.dropped = 0
+        self.peak = 0
+        self._slots = [None] * capacity
+        self._sizes = [0] * capacity
+        self._head = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        """
+        Iterates from the oldest item to the newest.
+        """
+        for i in range(self._size):
+            yield self._slots[(self._head + i) % self.capacity]
+
+    def __reversed__(self):
+        """
+        Iterates from the newest item to the oldest.
+        """
+        for i in range(self._size - 1, -1, -1):
+            yield self._slots[(self._head + i) % self.capacity]
+
+    def append(self, item, nbytes = 0):
+        """
+        Adds an item to the buffer, evicting the oldest items if it is full.
+
+        Parameters
+        ----------
+        item : object
+            Item to add.
+        nbytes : integer
+            Size of the item, counted against `max_bytes`.
+
+        Returns
+        -------
+        True if an item was evicted, False otherwise.
+        """
+        evicted = False
+        if self.max_bytes > 0:
+            while self._size > 0 and self.nbytes + nbytes > self.max_bytes:
+                self._evict()
+                evicted = True
+        if self._size == self.capacity:
+            self._evict()
+            evicted = True
+
+        tail = (self._head + self._size) % self.capacity
+        self._slots[tail] = item
+        self._sizes[tail] = nbytes
+        self.nbytes += nbytes
+        self._size += 1
+        if self._size > self.peak:
+            self.peak = self._size
+        return evicted
+
+    def clear(self):
+        """
+        Empties the buffer. Counters are left untouched.
+        """
+        self._slots = [None] * self.capacity
+        self._sizes = [0] * self.capacity
+        self.nbytes = 0
+        self._head = 0
+        self._size = 0
+
+    def _evict(self):
+        """
+        Drops the oldest item.
+        """
+        self._slots[self._head] = None
+        self.nbytes -= self._sizes[self._head]
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        self.dropped += 1
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the buffer's current length, capacity, size in bytes, byte
+        limit, dropped count and peak occupancy.
+        """
+        return {
+            'length': self._size,
+            'capacity': self.capacity,
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+            'dropped': self.dropped,
+            'peak': self.peak,
+        }
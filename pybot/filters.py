@@ -0,0 +1,208 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+class Stage(object):
+    """
+    One step of a FilterPipeline. Subclasses implement `process`, which
+    returns the status to pass on (possibly a modified one) or None to
+    reject it. Counts how many statuses it passed and rejected.
+    """
+
+    def __init__(self):
+        self.passed = 0
+        self.rejected = 0
+
+    @property
+    def name(self):
+        return type(self).__name__
+
+    def __call__(self, status):
+        status = self.process(status)
+        if status is None:
+            self.rejected += 1
+        else:
+            self.passed += 1
+        return status
+
+    def process(self, status):
+        raise NotImplementedError("Need to implement 'process'.")
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the stage's `name` and its `passed` and `rejected` counts.
+        """
+        return {'name': self.name, 'passed': self.passed, 'rejected': self.rejected}
+
+class Transform(Stage):
+    """
+    Stage that runs each status through a function, which returns the
+    status to pass on or None to reject it.
+    """
+
+    def __init__(self, function):
+        super(Transform, self).__init__()
+        self.function = function
+
+    @property
+    def name(self):
+        return 'Transform(%s)' % getattr(self.function, '__name__', self.function)
+
+    def process(self, status):
+        return self.function(status)
+
+class Predicate(Stage):
+    """
+    Stage that keeps the statuses for which `test` returns True.
+    """
+
+    def process(self, status):
+        return status if self.test(status) else None
+
+    def test(self, status):
+        raise NotImplementedError("Need to implement 'test'.")
+
+class LanguageFilter(Predicate):
+    """
+    Keeps statuses in one of the given languages, as tagged by Twitter
+    (e.g. 'en').
+    """
+
+    def __init__(self, languages):
+        super(LanguageFilter, self).__init__()
+        self.languages = frozenset(languages)
+
+    def test(self, status):
+        return getattr(status, 'lang', None) in self.languages
+
+class BlacklistFilter(Predicate):
+    """
+    Drops statuses by any of the given screen names (case-insensitive).
+    """
+
+    def __init__(self, screen_names):
+        super(BlacklistFilter, self).__init__()
+        self.blacklist = frozenset(s.lower() for s in screen_names)
+
+    def test(self, status):
+        return status.author.screen_name.lower() not in self.blacklist
+
+class RetweetFilter(Predicate):
+    """
+    Drops retweets, both native ones and old-style "RT @user" ones.
+    """
+
+    def test(self, status):
+        return not (hasattr(status, 'retweeted_status') or 'RT @' in status.text)
+
+class MinFollowersFilter(Predicate):
+    """
+    Drops statuses from users with fewer than `count` followers.
+    """
+
+    def __init__(self, count):
+        super(MinFollowersFilter, self).__init__()
+        self.count = count
+
+    def test(self, status):
+        return status.user.followers_count >= self.count
+
+class RegexFilter(Predicate):
+    """
+    Keeps statuses whose text matches `pattern` or, if `exclude` is True,
+    drops them.
+    """
+
+    def __init__(self, pattern, flags = re.IGNORECASE, exclude = False):
+        super(RegexFilter, self).__init__()
+        self.pattern = re.compile(pattern, flags)
+        self.exclude = exclude
+
+    @property
+    def name(self):
+        return 'RegexFilter(%r)' % self.pattern.pattern
+
+    def test(self, status):
+        return (self.pattern.search(status.text) is None) == self.exclude
+
+class FilterPipeline(object):
+    """
+    Chain of stages that statuses from the streaming API go through before
+    they're buffered. A status rejected by one stage isn't seen by the rest,
+    so put the cheapest and most selective stages first.
+    """
+
+    def __init__(self, stages = ()):
+        self.stages = list(stages)
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def add(self, stage):
+        """
+        Appends a stage to the end of the pipeline.
+
+        Parameters
+        ----------
+        stage : Stage or function
+            A function is wrapped in a Transform.
+
+        Returns
+        -------
+        The stage.
+        """
+        if not isinstance(stage, Stage):
+            stage = Transform(stage)
+        self.stages.append(stage)
+        return stage
+
+    def insert(self, index, stage):
+        """
+        Like `add`, but at position `index`.
+        """
+        if not isinstance(stage, Stage):
+            stage = Transform(stage)
+        self.stages.insert(index, stage)
+        return stage
+
+    def remove(self, stage):
+        self.stages.remove(stage)
+
+    def __call__(self, status):
+        """
+        Runs `status` through every stage.
+
+        Returns
+        -------
+        The (possibly transformed) status, or None if a stage rejected it.
+        """
+        for stage in self.stages:
+            status = stage(status)
+            if status is None:
+                return None
+        return status
+
+    def stats(self):
+        """
+        Returns
+        -------
+        List of each stage's stats, in order.
+        """
+        return [stage.stats() for stage in self.stages]
@@ -0,0 +1,247 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import bisect
+import collections.abc
+import pickle
+
+class IdSet(collections.abc.MutableSet):
+    """
+    Set of 64-bit integer IDs, stored as a sorted, packed array. Takes 8
+    bytes per ID instead of the ~60 of a Python set of ints, with
+    O(log n) membership tests by binary search.
+
+    Unions, differences and intersections with other IdSets are merges of
+    the two sorted arrays. Runs the two have in common, or that only one
+    of them has, are found by binary search and copied wholesale, so two
+    large sets that mostly agree are compared at memcmp speed.
+
+    Pickles as the raw array buffer. On load, the IDs are used in place
+    from the unpickled bytes (read-only) and only copied into a new array
+    the first time the set is modified.
+    """
+    __slots__ = ('_ids',)
+
+    def __init__(self, ids = ()):
+        if isinstance(ids, IdSet):
+            self._ids = array.array('q', ids._ids)
+        else:
+            self._ids = array.array('q', sorted(set(ids)))
+
+    @classmethod
+    def frombuffer(cls, buf):
+        """
+        Wraps a buffer of sorted, unique, native-endian int64s without
+        copying it.
+        """
+        s = cls.__new__(cls)
+        s._ids = memoryview(buf).cast('B').cast('q')
+        return s
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return cls(it)
+
+    @classmethod
+    def _wrap(cls, ids):
+        s = cls.__new__(cls)
+        s._ids = ids
+        return s
+
+    @property
+    def nbytes(self):
+        """
+        Size of the packed IDs, in bytes.
+        """
+        return len(self._ids) * 8
+
+    def tobytes(self):
+        return self._ids.tobytes()
+
+    def copy(self):
+        return IdSet(self)
+
+    def __contains__(self, x):
+        if not isinstance(x, int):
+            return False
+        i = bisect.bisect_left(self._ids, x)
+        return i < len(self._ids) and self._ids[i] == x
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __repr__(self):
+        return 'IdSet(<%s ids>)' % len(self._ids)
+
+    def __eq__(self, other):
+        if isinstance(other, IdSet):
+            return len(self) == len(other) and _view(self._ids) == _view(other._ids)
+        return super(IdSet, self).__eq__(other)
+
+    __hash__ = None
+
+    def __sub__(self, other):
+        return IdSet._wrap(_merge(self._ids, _as_ids(other), True, False, False))
+
+    def __rsub__(self, other):
+        return IdSet._wrap(_merge(_as_ids(other), self._ids, True, False, False))
+
+    def __or__(self, other):
+        return IdSet._wrap(_merge(self._ids, _as_ids(other), True, True, True))
+
+    __ror__ = __or__
+
+    def __and__(self, other):
+        return IdSet._wrap(_merge(self._ids, _as_ids(other), False, False, True))
+
+    __rand__ = __and__
+
+    def difference(self, *others):
+        result = self
+        for other in others:
+            result = result - other
+        return result if result is not self else self.copy()
+
+    def union(self, *others):
+        result = self
+        for other in others:
+            result = result | other
+        return result if result is not self else self.copy()
+
+    def intersection(self, *others):
+        result = self
+        for other in others:
+            result = result & other
+        return result if result is not self else self.copy()
+
+    def add(self, x):
+        ids = self._writable()
+        i = bisect.bisect_left(ids, x)
+        if i == len(ids) or ids[i] != x:
+            ids.insert(i, x)
+
+    def discard(self, x):
+        if x not in self:
+            return
+        ids = self._writable()
+        ids.pop(bisect.bisect_left(ids, x))
+
+    def update(self, it):
+        """
+        Adds many IDs at once, merging them in with a single pass.
+        """
+        self._ids = _merge(self._ids, _as_ids(it), True, True, True)
+
+    def difference_update(self, it):
+        """
+        Removes many IDs at once, with a single pass.
+        """
+        self._ids = _merge(self._ids, _as_ids(it), True, False, False)
+
+    def __ior__(self, it):
+        self.update(it)
+        return self
+
+    def __isub__(self, it):
+        self.difference_update(it)
+        return self
+
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5 and hasattr(pickle, 'PickleBuffer'):
+            return (_restore, (pickle.PickleBuffer(self._ids),))
+        return (_restore, (self.tobytes(),))
+
+    def _writable(self):
+        """
+        Swaps a read-only buffer for an array the first time it's modified.
+        """
+        if not isinstance(self._ids, array.array):
+            ids = array.array('q')
+            ids.frombytes(self._ids.cast('B'))
+            self._ids = ids
+        return self._ids
+
+def _restore(buf):
+    return IdSet.frombuffer(buf)
+
+def _view(ids):
+    return ids if isinstance(ids, memoryview) else memoryview(ids)
+
+def _as_ids(other):
+    """
+    The sorted IDs of an IdSet, or of any other iterable of IDs.
+    """
+    if isinstance(other, IdSet):
+        return other._ids
+    return array.array('q', sorted(set(other)))
+
+def _merge(a, b, only_a, only_b, both):
+    """
+    Merges two sorted, unique ID sequences, keeping the IDs only in `a`,
+    only in `b`, and/or in both.
+
+    Returns
+    -------
+    A new array.array of the kept IDs.
+    """
+    a = _view(a)
+    b = _view(b)
+    out = array.array('q')
+    i, j = 0, 0
+    n, m = len(a), len(b)
+    while i < n and j < m:
+        x, y = a[i], b[j]
+        if x < y:
+            k = bisect.bisect_left(a, y, i)
+            if only_a:
+                out.frombytes(a[i:k].cast('B'))
+            i = k
+        elif y < x:
+            k = bisect.bisect_left(b, x, j)
+            if only_b:
+                out.frombytes(b[j:k].cast('B'))
+            j = k
+        else:
+            k = _common_run(a, i, b, j)
+            if both:
+                out.frombytes(a[i:i + k].cast('B'))
+            i += k
+            j += k
+    if only_a:
+        out.frombytes(a[i:].cast('B'))
+    if only_b:
+        out.frombytes(b[j:].cast('B'))
+    return out
+
+def _common_run(a, i, b, j):
+    """
+    Length of the longest run a[i:i + k] == b[j:j + k], given a[i] == b[j]:
+    galloping, then a binary search, over slice comparisons.
+    """
+    limit = min(len(a) - i, len(b) - j)
+    lo, hi = 1, 2
+    while hi <= limit and a[i:i + hi] == b[j:j + hi]:
+        lo, hi = hi, hi * 2
+    hi = min(hi, limit + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[i:i + mid] == b[j:j + mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
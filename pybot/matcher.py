@@ -0,0 +1,82 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+# Splits tweet text into words, keeping @-mentions intact.
+_TOKENS = re.compile(r'[^@\w]')
+
+class Matcher(object):
+    """
+    Keyword, blacklist and mention matching, compiled once from a PyBot's
+    configuration and shared by all the handlers.
+
+    Keywords and blacklisted screen names are held in frozensets, so the
+    per-tweet cost depends on the length of the tweet rather than on the
+    number of keywords or blacklisted users. All comparisons are
+    case-insensitive.
+    """
+
+    def __init__(self, screen_name, autofav_keywords = (), blacklist = ()):
+        self.screen_name = screen_name.lower()
+        self.autofav_keywords = frozenset(k.lower() for k in autofav_keywords)
+        self.blacklist = frozenset(b.lower() for b in blacklist)
+        self._self_mention = re.compile('@%s' % re.escape(screen_name), flags = re.IGNORECASE)
+
+    @classmethod
+    def from_config(cls, screen_name, config):
+        """
+        Builds a Matcher from a PyBot's `config` dictionary.
+        """
+        return cls(screen_name, config['autofav_keywords'], config['blacklist'])
+
+    def has_autofav_keyword(self, text):
+        """
+        True if any whitespace-separated word of `text` is an autofav keyword.
+        """
+        if len(self.autofav_keywords) == 0:
+            return False
+        return not self.autofav_keywords.isdisjoint(text.lower().split())
+
+    def is_blacklisted(self, screen_name):
+        """
+        True if `screen_name` is on the blacklist.
+        """
+        return screen_name.lower() in self.blacklist
+
+    def is_self(self, screen_name):
+        """
+        True if `screen_name` belongs to this bot.
+        """
+        return screen_name.lower() == self.screen_name
+
+    def mentions_self(self, text):
+        """
+        True if `text` mentions this bot anywhere.
+        """
+        return self._self_mention.search(text) is not None
+
+    def is_direct_mention(self, text):
+        """
+        True if `text` starts by mentioning this bot.
+        """
+        return _TOKENS.split(text, 1)[0].lower() == '@%s' % self.screen_name
+
+    def mentions(self, text):
+        """
+        Lists the @-mentions in `text`, other than of this bot or of
+        blacklisted users, in the order they appear.
+        """
+        return [s for s in _TOKENS.split(text) if len(s) > 2 and s[0] == '@' and
+            s[1:].lower() != self.screen_name and s[1:].lower() not in self.blacklist]
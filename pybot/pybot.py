@@ -12,27 +12,77 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
 import http.client
+import itertools
 import logging
 import multiprocessing as mp
-import re
 import signal
 import sys
+import threading
 import time
 
 import tweepy
 
+from .buffer import RingBuffer
+from .idset import IdSet
+from .filters import BlacklistFilter, FilterPipeline
+from .matcher import Matcher
+from .record import DEFAULT_FIELDS, Projection
+from .ratelimit import DEFAULT_API_LIMITS, GovernedAPI, RateGovernor
+from .scheduler import Scheduler
+from .seen import SeenCache
+from .spill import SpillBuffer
+from .state import State
 from .storage import PickleStorage
+from .transport import Transport
+from .writequeue import WriteQueue
 
 class PyBot(tweepy.StreamListener):
 
-    def __init__(self):
+    def __init__(self, api_client = None, stream_factory = None):
+        """
+        Parameters
+        ----------
+        api_client : object
+            Twitter client to use instead of tweepy.API, such as a
+            pybot.simulator.SimulatedTwitter. Same as the `api_client` config
+            option.
+        stream_factory : callable
+            Makes the streaming client instead of tweepy.Stream. Same as the
+            `stream_factory` config option.
+        """
         # Basic configuration and state variables for the bot.
         self.config = {}
-        self.state = {}
+        self.state = State()
+
+        # Main Twitter endpoint behind each built-in action, for deferring an
+        # action until that endpoint has rate limit budget.
+        self.action_endpoints = {
+            'timeline': 'home_timeline',
+            'mention': 'mentions_timeline',
+            'follow': 'followers_ids',
+            'tweet': 'update_status',
+            'graph': 'friends_ids',
+        }
+
+        # Priority queue of built-in actions and user-defined callbacks.
+        self.scheduler = Scheduler()
+        self._custom_keys = itertools.count()
+
+        # Guards self.state against concurrent actions in worker thread mode;
+        # hold it in your own callbacks if two of them touch the same state.
+        # The event wakes the run loop when a worker finishes an action.
+        self.state_lock = threading.RLock()
+        self._wakeup = threading.Event()
 
-        # List of custom callbacks that are user-defined.
-        self.custom_callbacks = []
+        # How late each action has started, relative to when it was due; see
+        # `action_stats()`.
+        self._lags = {}
 
         # # # # # # # # # # # # # # # # # # # # # # #
         # Configuration options and their defaults. #
@@ -53,10 +103,41 @@ class PyBot(tweepy.StreamListener):
         # Number of tweets allowed to be buffered in-memory from the streaming
         # API. Increasing this number gives you a larger sample of tweets, but
         # it can potentially crash your machine if the number is too high.
-        # If an incoming status would overflow the buffer, the oldest status in
-        # the buffer is discarded.
+        # If an incoming status would overflow the buffer, what happens depends
+        # on `streaming_overflow` below.
         self.config['streaming_buffer_length'] = 100000
 
+        # Cap on the (approximate) memory taken up by the buffered statuses,
+        # in bytes. Set to 0 to limit the buffer by `streaming_buffer_length`
+        # alone.
+        self.config['streaming_buffer_bytes'] = 0
+
+        # What to do with statuses that don't fit in the buffer. 'drop'
+        # discards the oldest buffered status (see `buffer_stats()` for how
+        # many). 'spill' writes the overflow to segment files in
+        # `streaming_spill_dir` (default: the system's temporary directory),
+        # which are read back in order on the next search; set
+        # `streaming_spill_bytes` to cap their total size (0 for no limit),
+        # past which new statuses are dropped.
+        self.config['streaming_overflow'] = 'drop'
+        self.config['streaming_spill_dir'] = None
+        self.config['streaming_spill_bytes'] = 0
+
+        # Backlog watermarks, in number of buffered statuses. When the buffer
+        # reaches the high watermark, `on_buffer_high` is called; once a
+        # search drains no more than the low watermark, `on_buffer_low` is.
+        # Set the high watermark to 0 to turn this off.
+        self.config['streaming_high_watermark'] = 0
+        self.config['streaming_low_watermark'] = 0
+
+        # Fields kept from each streamed status, as attribute paths such as
+        # 'user.screen_name'. Handlers receive compact records holding only
+        # these fields (reading any other field raises AttributeError). Set
+        # `stream_keep_full` to True to also keep the full tweepy.Status,
+        # available as `record.status`, at a much larger memory cost.
+        self.config['stream_fields'] = list(DEFAULT_FIELDS)
+        self.config['stream_keep_full'] = False
+
         # List of keywords to search for and take action on when found.
         # NOTE: This is a completely separate list of keywords from the
         # `autofav_keywords` list below.
@@ -85,7 +166,41 @@ class PyBot(tweepy.StreamListener):
         # for more details.
         self.config['logging_level'] = logging.DEBUG
 
-        # Adapter for saving/loading this PyBot's state.
+        # HTTP transport for REST calls. Leave as None to share the default
+        # pool of keep-alive connections with every other bot in the process,
+        # or provide a pybot.transport.Transport to tune pool sizes/timeouts.
+        self.config['transport'] = None
+
+        # Twitter clients. Leave as None to talk to Twitter through tweepy.
+        # Otherwise, `api_client` stands in for tweepy.API, and
+        # `stream_factory(listener)` returns a stand-in for tweepy.Stream
+        # that delivers statuses to `listener.on_status`; see
+        # pybot.simulator for an offline backend.
+        self.config['api_client'] = api_client
+        self.config['stream_factory'] = stream_factory
+
+        # How long (in seconds) the bot's own identity and the IDs of the
+        # accounts it follows are cached in its state before being fetched
+        # again. The friends list is refreshed by a scheduled action once the
+        # bot is running, and then every `graph_ttl` seconds; if a refresh
+        # fails, it is retried after `graph_retry_interval` seconds.
+        self.config['identity_ttl'] = 24 * 60 * 60
+        self.config['graph_ttl'] = 24 * 60 * 60
+        self.config['graph_retry_interval'] = 60
+
+        # If True, the IDs of the bot's friends and followers are kept as
+        # sorted, packed 64-bit arrays (pybot.idset.IdSet) rather than Python
+        # sets: several times smaller in memory, for accounts with very large
+        # followings. They behave like sets either way.
+        self.config['compact_ids'] = False
+
+        # State is only saved when it has changed, and then at most once every
+        # `save_interval` seconds; changes in between are written together.
+        # Set to 0 to save as soon as the bot wakes up after any change.
+        self.config['save_interval'] = 0
+
+        # Adapter for saving/loading this PyBot's state. For bots with lots of
+        # friends or followers, SQLiteStorage() only writes what has changed.
         self.config['storage'] = PickleStorage()
 
         # Denotes users the bot will never mention or respond to.
@@ -94,12 +209,49 @@ class PyBot(tweepy.StreamListener):
         # Languages to filter on when conducting searches.
         self.config['languages'] = ['en']
 
+        # If True, update_status, create_favorite and create_friendship don't
+        # wait for Twitter; they queue the call and return a Future instead.
+        # Queued calls are made in the background, each as soon as its
+        # endpoint has budget under `api_rate_limits` below, and repeat
+        # favorites/follows of the same tweet/user are skipped.
+        self.config['write_queue'] = False
+
+        # Per-endpoint call budgets (endpoint: (calls, seconds)). Calls are
+        # spaced out to stay within them, corrected by the rate limit headers
+        # Twitter sends back, and actions whose endpoint is out of budget are
+        # put off until it isn't. See `rate_budgets()`.
+        self.config['api_rate_limits'] = dict(DEFAULT_API_LIMITS)
+
+        # Number of worker threads used to run due actions concurrently, so
+        # one slow action doesn't hold up the others. An action never runs
+        # alongside itself. Set to 0 to run every action on the main thread.
+        self.config['worker_threads'] = 0
+
+        # Tweets already handled by one action (timeline, mention or search)
+        # are skipped by the others, and after restarts. The last
+        # `seen_cache_size` tweet IDs are remembered exactly, and roughly the
+        # last `seen_horizon` approximately (a new tweet is mistaken for a
+        # seen one at a rate of about `seen_error_rate`). See `seen_stats()`.
+        # Set `seen_cache_size` to 0 to handle every tweet. The cache is
+        # saved with the state at most every `seen_save_interval` seconds,
+        # and on shutdown.
+        self.config['seen_cache_size'] = 10000
+        self.config['seen_horizon'] = 100000
+        self.config['seen_error_rate'] = 0.001
+        self.config['seen_save_interval'] = 15 * 60
+
         #
         # End configuration options.
         #
         # Now we start initializing the bot.
         #
 
+        # Stages that statuses from the streaming API go through before being
+        # buffered; add yours in bot_init, e.g.
+        # `self.stream_filters.add(RetweetFilter())` (see pybot.filters).
+        # Statuses by blacklisted users are always filtered out first.
+        self.stream_filters = FilterPipeline()
+
         # Required implementation by all subclasses. Produces an error if it
         # is not implemented.
         self.bot_init()
@@ -107,27 +259,39 @@ class PyBot(tweepy.StreamListener):
         # Set up a signal handler so a bot can gracefully exit.
         signal.signal(signal.SIGINT, self._handler)
 
-        # Set up OAuth with Twitter and pull down some basic identities.
-        auth = tweepy.OAuthHandler(self.config['api_key'], self.config['api_secret'])
-        auth.set_access_token(self.config['access_key'], self.config['access_secret'])
-        self.api = tweepy.API(auth)
-        self.id = self.api.me().id
-        self.screen_name = self.api.me().screen_name
-
-        # Set up the streaming API. May or may not need this.
-        self.stream = tweepy.Stream(auth, self)
-        self.lock = mp.Lock()
-        self.buffer = []
-
         # Set up logging.
         logging.basicConfig(format = '%(asctime)s | %(levelname)s: %(message)s',
             datefmt = '%m/%d/%Y %I:%M:%S %p',
             filename = '{}.log'.format(self.config['bot_name']),
             level = self.config['logging_level'])
+        logging.info("---STARTUP---")
+
+        # Set up OAuth with Twitter, unless another client was provided.
+        auth = None
+        api = self.config['api_client']
+        self.transport = None
+        if api is None or self.config['stream_factory'] is None:
+            auth = tweepy.OAuthHandler(self.config['api_key'], self.config['api_secret'])
+            auth.set_access_token(self.config['access_key'], self.config['access_secret'])
+        if api is None:
+            self.transport = self.config['transport']
+            if self.transport is None:
+                self.transport = Transport.default()
+            api = self.transport.attach(tweepy.API(auth))
+        self.governor = RateGovernor(self.config['api_rate_limits'])
+        self.api = GovernedAPI(api, self.governor)
+
+        # Set up the outbound write queue, if requested.
+        self.writes = None
+        if self.config['write_queue']:
+            self.writes = WriteQueue(self.governor)
+
+        # Set once the bot knows who follows it; see `_refresh_graph`.
+        self.graph_ready = threading.Event()
 
         # Try to load any previous state.
-        logging.info("---STARTUP---")
         logging.info("Setting bot state...")
+        start = time.time()
         s = self.config['storage'].read('{}_state.pkl'.format(self.config['bot_name']))
         if s is None:
             # No previous state to load? Initialize everything.
@@ -158,21 +322,74 @@ class PyBot(tweepy.StreamListener):
             self.state['last_tweet_time'] = curr_t
             self.state['next_tweet_time'] = self._increment(curr_t, self.config['tweet_interval'])
 
-            # List of user IDs you follow.
-            self.state['friends'] = self.api.friends_ids(self.id)
+            # Set of user IDs you follow, and when it was last fetched. These
+            # are filled in by `_refresh_graph` once the bot is running.
+            self.state['friends'] = self._id_set(())
+            self.state['graph_time'] = 0
 
-            # List of user IDs that follow you.
-            self.state['followers'] = self.api.followers_ids(self.id)
+            # Set of user IDs that follow you.
+            self.state['followers'] = self._id_set(())
 
             # List of new followers since the last check (internal) timestamp.
             self.state['new_followers'] = []
             self.state['last_follow_time'] = curr_t
             self.state['next_follow_time'] = self._increment(curr_t, self.config['follow_interval'])
+
+            # Who this bot is, and when that was last fetched.
+            self.state['identity'] = None
+
+            # IDs of the tweets handled so far.
+            self.state['seen'] = self._new_seen_cache()
         else:
             # Use loaded state.
-            self.state = s
+            self.state = State(s)
+
+            # Older state files store the social graph as lists, and don't
+            # cache the bot's identity.
+            self.state['friends'] = self._id_set(self.state['friends'])
+            self.state['followers'] = self._id_set(self.state['followers'])
+            self.state.setdefault('graph_time', 0)
+            self.state.setdefault('identity', None)
+            if self.state.get('seen') is None:
+                self.state['seen'] = self._new_seen_cache()
+            self.graph_ready.set()
+            self.state.clean()
+        self._last_save = time.time()
+        self._seen_save = (self._last_save, self._seen_misses())
+        logging.info("Bot state set in %.3f seconds." % (time.time() - start))
+
+        # Pull down the bot's identity, unless a recent copy is cached.
+        start = time.time()
+        identity = self.state['identity']
+        if identity is None or time.time() - identity['time'] > self.config['identity_ttl']:
+            me = self.api.me()
+            identity = {'id': me.id, 'screen_name': me.screen_name, 'time': time.time()}
+            self.state['identity'] = identity
+            logging.info("Identity fetched in %.3f seconds." % (time.time() - start))
+        else:
+            logging.info("Identity loaded from cache.")
+        self.id = identity['id']
+        self.screen_name = identity['screen_name']
+
+        # Keyword, blacklist and mention matching for all the handlers. If
+        # you change `autofav_keywords` or `blacklist` later on, rebuild this
+        # with `Matcher.from_config`; streamed statuses are checked against
+        # the blacklist by the BlacklistFilter stage alone, so replace that
+        # too.
+        self.matcher = Matcher.from_config(self.screen_name, self.config)
+        if len(self.matcher.blacklist) > 0:
+            self.stream_filters.insert(0, BlacklistFilter(self.matcher.blacklist))
 
-        logging.info("Bot state set.")
+        # Set up the streaming API. May or may not need this.
+        if self.config['stream_factory'] is None:
+            self.stream = tweepy.Stream(auth, self)
+        else:
+            self.stream = self.config['stream_factory'](self)
+        self.lock = mp.Lock()
+        self.projection = Projection(self.config['stream_fields'], self.config['stream_keep_full'])
+        self.buffer = self._new_buffer()
+        self._spare_buffer = self._new_buffer()
+        self.buffer_overloaded = False
 
     # # # # # # # # # # # # # # # # # # # # # # #
     #       Available should the user wish.     #
@@ -190,14 +407,195 @@ class PyBot(tweepy.StreamListener):
         interval : integer or callable
             Number of seconds to wait before execution, or a
             callable that returns the number of seconds to wait.
+
+        Returns
+        -------
+        Key identifying the callback, for use with `cancel_custom_callback`
+        and `reschedule_custom_callback`.
         """
-        callback = {
-            'action': action,
-            'interval': interval,
-            'last_run': 0,
-            'next_run': 0,
-        }
-        self.custom_callbacks.append(callback)
+        key = ('custom', next(self._custom_keys))
+        self.scheduler.schedule(key, action, interval)
+        return key
+
+    def cancel_custom_callback(self, key):
+        """
+        Unregisters a user-defined callback. Safe to call from within the
+        callback itself.
+
+        Parameters
+        ----------
+        key : tuple
+            Key returned by `register_custom_callback`.
+
+        Returns
+        -------
+        True if the callback was registered, False otherwise.
+        """
+        return self.scheduler.cancel(key)
+
+    def reschedule_custom_callback(self, key, when):
+        """
+        Moves a user-defined callback to run at a different time.
+
+        Parameters
+        ----------
+        key : tuple
+            Key returned by `register_custom_callback`.
+        when : float
+            Timestamp (as from time.time()) at which the callback should run.
+
+        Returns
+        -------
+        True if the callback was registered, False otherwise.
+        """
+        return self.scheduler.reschedule(key, when)
+
+    def rate_budgets(self):
+        """
+        Reports the remaining call budget of each rate-limited endpoint.
+
+        Returns
+        -------
+        Dict of endpoint name to a dict of available `tokens`, bucket
+        `capacity`, and the `remaining` calls and `reset` time Twitter last
+        reported.
+        """
+        return self.governor.budgets()
+
+    def drain_buffer(self):
+        """
+        Hands over everything received from the streaming API so far. The
+        active buffer is swapped for an empty one under the lock, so no
+        statuses are copied and none that arrive mid-drain are lost.
+
+        Returns
+        -------
+        Buffer of TweetRecords (see `stream_fields`). Iterate over it for
+        oldest to newest, or use reversed() for newest to oldest. Statuses
+        spilled to disk are read back as you go.
+        """
+        with self.lock:
+            fresh = self._spare_buffer
+            self._spare_buffer = None
+            if fresh is None:
+                # A concurrent drain took the spare and hasn't replaced it.
+                fresh = self._new_buffer()
+            drained = self.buffer
+            fresh.dropped = drained.dropped
+            fresh.peak = drained.peak
+            self.buffer = fresh
+
+        # Allocate the next spare outside the lock.
+        spare = self._new_buffer()
+        with self.lock:
+            self._spare_buffer = spare
+
+        if self.buffer_overloaded and len(drained) <= self.config['streaming_low_watermark']:
+            self.buffer_overloaded = False
+            self.on_buffer_low(drained.stats())
+        return drained
+
+    def buffer_stats(self):
+        """
+        Reports on the streaming buffer.
+
+        Returns
+        -------
+        Dict with the buffer's current `length` and `capacity`, its size in
+        `bytes` and `max_bytes` limit, the number of statuses `dropped`
+        because the buffer was full, and the `peak` number of statuses
+        buffered at once. In 'spill' mode, also the number of statuses
+        `spilled` to disk and the `spill_bytes` they take up.
+        """
+        with self.lock:
+            return self.buffer.stats()
+
+    def stream_filter_stats(self):
+        """
+        Reports on the streaming filter pipeline.
+
+        Returns
+        -------
+        List of dicts, one per stage in order, with the stage's `name` and
+        the number of statuses it `passed` and `rejected`.
+        """
+        return self.stream_filters.stats()
+
+    def action_stats(self):
+        """
+        Reports how closely actions, built-in and custom, have kept to their
+        schedule.
+
+        Returns
+        -------
+        Dict of action name to a dict with the number of `runs`, and the
+        `mean_lag` and `max_lag`: how many seconds after it was due the
+        action started.
+        """
+        with self.state_lock:
+            return {name: {'runs': runs, 'mean_lag': total / runs, 'max_lag': worst}
+                for name, (runs, total, worst) in self._lags.items()}
+
+    def seen_stats(self):
+        """
+        Reports on the cache of tweets already handled.
+
+        Returns
+        -------
+        Dict with the number of tweets skipped as already seen (`hits`) and
+        handled (`misses`), the `hit_rate`, and the number of IDs held
+        exactly (`recent`) and approximately (`bloom`). None if the cache
+        is disabled.
+        """
+        if self.state['seen'] is None:
+            return None
+        return self.state['seen'].stats()
+
+    def on_stream_status(self, status):
+        """
+        Called on the streaming thread with each status that got through the
+        `stream_filters`, before it's buffered. Override this to consume
+        statuses as they arrive (e.g. to update a model) rather than waiting
+        for the next search; keep it quick, as the stream waits on it.
+
+        Parameters
+        ----------
+        status : tweepy.Status
+            The status, as received.
+
+        Returns
+        -------
+        False to leave the status out of the buffer; anything else buffers
+        it.
+        """
+        return True
+
+    def on_buffer_high(self, stats):
+        """
+        Called on the streaming thread when the buffer reaches
+        `streaming_high_watermark`. Override this to shed load (e.g. tighten
+        the stream filter) or to throttle; sleeping here slows down reading
+        from the stream, pushing back on Twitter rather than buffering more.
+
+        Parameters
+        ----------
+        stats : dict
+            The buffer's stats, as from `buffer_stats()`.
+        """
+        logging.warn("Streaming buffer is backing up: %s statuses buffered, %s dropped." %
+            (stats['length'], stats['dropped']))
+
+    def on_buffer_low(self, stats):
+        """
+        Called once a search drains no more than `streaming_low_watermark`
+        statuses, after `on_buffer_high` was.
+
+        Parameters
+        ----------
+        stats : dict
+            The drained buffer's stats.
+        """
+        logging.info("Streaming buffer has caught up: %s statuses drained." % stats['length'])
 
     # # # # # # # # # # # # # # # # # # # # # # #
     #      Methods that MUST be implemented.    #
@@ -230,48 +628,46 @@ class PyBot(tweepy.StreamListener):
         PyBot's main run method. This activates ALL the things.
         """
         self.running = True
+        self._schedule_actions()
+        executor = None
+        if self.config['worker_threads'] > 0:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.config['worker_threads'])
+
         while self.running:
-            intervals = []
+            self._wakeup.clear()
             current_time = time.time()
 
-            # Check all the built-in actions.
-            for action in self.actions:
-                if self.config['%s_interval' % action] != 0 and \
-                        current_time > self.state['next_%s_time' % action]:
-
-                    # Do something.
-                    getattr(self, '_handle_%s' % action)()
-
-                    # Update state.
-                    self.state['last_%s_time' % action] = current_time
-                    self.state['next_%s_time' % action] = self._increment(current_time, self.config['%s_interval' % action])
-                if self.config['%s_interval' % action] != 0:
-                    intervals.append(self.state['next_%s_time' % action])
-
-            # Check custom handlers.
-            for callback in self.custom_callbacks:
-                if current_time > callback['next_run']:
-                    # Invoke the action!
-                    callback['action']()
-
-                    # Update the interval for the next run.
-                    callback['last_run'] = current_time
-                    callback['next_run'] = self._increment(current_time, callback['interval'])
-                intervals.append(callback['next_run'])
-
-            # Are there any more actions?
-            if len(intervals) == 0:
+            # Run everything that has come due, built-in and custom alike.
+            for action in self.scheduler.pop_due(current_time):
+                if self._defer(action, current_time):
+                    continue
+                if executor is None:
+                    self._dispatch(action, current_time)
+                else:
+                    future = executor.submit(action.callback)
+                    future.add_done_callback(
+                        lambda f, action = action, t = current_time: self._dispatch_done(f, action, t))
+
+            # Are there any more actions? Ones still running in a worker
+            # thread count, even though they aren't queued right now.
+            if not self._has_actions():
                 logging.warn("No actions are set! Switching bot OFF.")
                 self.running = False
             else:
                 # Save the current state.
                 self._save_state()
 
-                # Find the next timestamp.
-                next_action = min(intervals)
-                if current_time < next_action:
+                # Sleep until the next action (or pending save) is due, or
+                # until a worker thread finishes an action and requeues it.
+                next_action = self._next_wake_time()
+                if next_action is None:
+                    self._wakeup.wait()
+                elif current_time < next_action:
                     logging.info("Sleeping for %.4f seconds." % (next_action - current_time))
-                    time.sleep(next_action - current_time)
+                    self._wakeup.wait(next_action - current_time)
+
+        if executor is not None:
+            executor.shutdown(wait = True)
 
         # If the loop breaks, someone hit CTRL+C.
         logging.info("---SHUTDOWN---")
@@ -296,7 +692,56 @@ class PyBot(tweepy.StreamListener):
 
         Returns
         -------
-        True on success, False on failure.
+        True on success, False on failure. If `write_queue` is enabled, a
+        concurrent.futures.Future of that instead.
+        """
+        if self.writes is not None:
+            return self.writes.submit('update_status', self._update_status, (status, reply_to, lat, lon))
+        return self._update_status(status, reply_to, lat, lon)
+
+    def create_favorite(self, tweet):
+        """
+        Basic DSL for favorite-ing a tweet.
+
+        Parameters
+        ----------
+        tweet : tweepy.Status
+            tweepy Status object.
+
+        Returns
+        -------
+        True on success, False on failure. If `write_queue` is enabled, a
+        concurrent.futures.Future of that instead.
+        """
+        if self.writes is not None:
+            return self.writes.submit('create_favorite', self._create_favorite, (tweet,), dedupe = ('favorite', tweet.id))
+        return self._create_favorite(tweet)
+
+    def create_friendship(self, friend):
+        """
+        Basic DSL for following a twitter user.
+
+        Parameters
+        ----------
+        friend : integer
+            Twitter ID of the user to follow.
+
+        Returns
+        -------
+        True on success, False on failure. If `write_queue` is enabled, a
+        concurrent.futures.Future of that instead.
+        """
+        if self.writes is not None:
+            return self.writes.submit('create_friendship', self._create_friendship, (friend,), dedupe = ('friendship', friend))
+        return self._create_friendship(friend)
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #     Helper methods. Leave these alone.    #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    def _update_status(self, status, reply_to, lat, lon):
+        """
+        Performs the `update_status` API call.
         """
         status = status.format('utf8', 'ignore')
         kwargs = {'status': status}
@@ -315,56 +760,35 @@ class PyBot(tweepy.StreamListener):
             return True
 
         except tweepy.TweepError as e:
-            logging.error("Unable to post tweet: %s" % e[0][0]['message'])
+            logging.error("Unable to post tweet: %s" % e)
             return False
 
-    def create_favorite(self, tweet):
+    def _create_favorite(self, tweet):
         """
-        Basic DSL for favorite-ing a tweet.
-
-        Parameters
-        ----------
-        tweet : tweepy.Status
-            tweepy Status object.
-
-        Returns
-        -------
-        True on success, False on failure.
+        Performs the `create_favorite` API call.
         """
         try:
             logging.info("Favoriting %s" % self._tweet_url(tweet))
             self.api.create_favorite(tweet.id)
             return True
         except tweepy.TweepError as e:
-            logging.error("Unable to favorite tweet: %s" % e[0][0]['message'])
+            logging.error("Unable to favorite tweet: %s" % e)
             return False
 
-    def create_friendship(self, friend):
+    def _create_friendship(self, friend):
         """
-        Basic DSL for following a twitter user.
-
-        Parameters
-        ----------
-        friend : integer
-            Twitter ID of the user to follow.
-
-        Returns
-        -------
-        True on success, False on failure.
+        Performs the `create_friendship` API call.
         """
         try:
             logging.info("Following user %s" % friend)
             self.api.create_friendship(friend, follow = True)
-            self.state['friends'].append(friend)
+            with self.state_lock:
+                self.state.add_ids('friends', [friend])
             return True
         except tweepy.TweepError as e:
-            logging.error("Unable to follow user '%s': %s" % (friend, e[0][0]['message']))
+            logging.error("Unable to follow user '%s': %s" % (friend, e))
             return False
 
-    # # # # # # # # # # # # # # # # # # # # # # #
-    #     Helper methods. Leave these alone.    #
-    # # # # # # # # # # # # # # # # # # # # # # #
-
     def _handle_tweet(self):
         """
         Processes posting a tweet.
@@ -378,40 +802,18 @@ class PyBot(tweepy.StreamListener):
         Processes the home timeline for the bot (excludes mentions).
         """
         logging.info("Reading current timeline...")
-        try:
+        with self._api_errors("retrieve timeline", "timeline update"):
             # Retrieve the last 500 posts on the timeline.
             timeline = self.api.home_timeline(
                 since_id = self.state['last_timeline_id'], count = 500)
 
-            # Delete tweets this bot posted, tweets that mention this bot, and blacklisted users.
-            current_timeline = []
-            for t in timeline:
-                if t.author.screen_name.lower() != self.screen_name.lower() and \
-                        t.author.screen_name.lower() not in self.blacklist and \
-                        not re.search('@%s' % self.screen_name, t.text, flags = re.IGNORECASE):
-                    current_timeline.append(t)
-
-            # Do we ignore ALL mentions (tweets that mention OTHER users, NOT the bot)?
-            if self.config['ignore_timeline_mentions']:
-                current_timeline = [t for t in current_timeline if '@' not in t.text]
-
-            # Process what's left over.
-            if len(current_timeline) > 0:
-                self.state['last_timeline_id'] = current_timeline[0].id
-                for tweet in list(reversed(current_timeline)):
-                    # Run the tweet through the timeline callback.
-                    prefix = self._mention_prefix(tweet)
-                    self.on_timeline(tweet, prefix)
-
-                    # Check the tokens in the tweet for keywords.
-                    words = tweet.text.lower().split()
-                    if any(w in words for w in self.config['autofav_keywords']):
-                        self.create_favorite(tweet)
+            for tweet, prefix in self._timeline_tweets(timeline):
+                # Run the tweet through the timeline callback.
+                self.on_timeline(tweet, prefix)
 
-        except tweepy.TweepError as e:
-            logging.error("Unable to retrieve timeline: %s" % e[0][0]['message'])
-        except http.client.IncompleteRead as e:
-            logging.error("IncompleteRead error, aborting timeline update.")
+                # Check the tokens in the tweet for keywords.
+                if self.matcher.has_autofav_keyword(tweet.text):
+                    self.create_favorite(tweet)
 
         logging.info("Finished processing timeline.")
 
@@ -420,32 +822,18 @@ class PyBot(tweepy.StreamListener):
         Processes the list of mentions for the bot.
         """
         logging.info("Checking for new mentions...")
-        try:
+        with self._api_errors("retrieve mentions", "mentions"):
             # Snag the last 100 mentions.
             mentions = self.api.mentions_timeline(
                 since_id = self.state['last_mention_id'], count = 100)
 
-            # Do we only look at direct mentions?
-            if self.config['reply_direct_mention_only']:
-                mentions = [t for t in mentions if re.split('[^@\w]', t.text)[0] == '@%s' % self.screen_name]
-
-            # Process remaining mentions.
-            if len(mentions) > 0:
-                self.state['last_mention_id'] = mentions[0].id
-                for mention in list(reversed(mentions)):
-
-                    # Send the tweet to the callback.
-                    prefix = self._mention_prefix(mention)
-                    self.on_mention(mention, prefix)
-
-                    # Do we autofav?
-                    if self.config['autofav_direct_mentions']:
-                        self.create_favorite(mention)
+            for mention, prefix in self._mention_tweets(mentions):
+                # Send the tweet to the callback.
+                self.on_mention(mention, prefix)
 
-        except tweepy.TweepError as e:
-            logging.error("Unable to retrieve mentions: %s" % e[0][0]['message'])
-        except http.client.IncompleteRead as e:
-            logging.error("IncompleteRead error, aborting mentions.")
+                # Do we autofav?
+                if self.config['autofav_direct_mentions']:
+                    self.create_favorite(mention)
 
         logging.info("Finished processing mentions.")
 
@@ -454,59 +842,28 @@ class PyBot(tweepy.StreamListener):
         Conducts a keyword search.
         """
         logging.info("Searching for keywords...")
+        for tweet in self._search_tweets():
+            self.on_search(tweet)
 
-        # Is the streamer even running?
-        if not self.stream.running:
-            # Are there any keywords we should be filtering on?
-            if len(self.config['search_keywords']) > 0:
-                # Yes, do a filter on the keywords.
-                logging.info("Starting the streaming filter.")
-                self.stream.filter(languages = self.config['languages'],
-                    track = self.config['search_keywords'],
-                    is_async = True)
-            else:
-                # Nope, just do a sample.
-                self.stream.sample(languages = self.config['languages'], is_async = True)
-                logging.info("Starting the streaming sample.")
-        else:
-            # Grab the static snapshot of the current buffer.
-            tweets = list(reversed(self.buffer))
-
-            # Clear out the buffer.
-            self.lock.acquire()
-            self.buffer = []
-            self.lock.release()
-
-            # Process the tweets.
-            logging.info("Received %s tweets from the streaming API, now processing." % len(tweets))
-            for tweet in tweets:
-                if tweet.author.screen_name in self.config['blacklist']: continue
-                self.on_search(tweet)
-
-                # Test for autofav keywords.
-                # Check the tokens in the tweet for keywords.
-                words = tweet.text.lower().split()
-                if any(w in words for w in self.config['autofav_keywords']):
-                    self.create_favorite(tweet)
+            # Test for autofav keywords.
+            if self.matcher.has_autofav_keyword(tweet.text):
+                self.create_favorite(tweet)
 
         logging.info("Search complete.")
 
-    def _handle_followers(self):
+    def _handle_follow(self):
         """
         Processes new followers and invokes the appropriate callback.
         """
         logging.info("Checking for new followers...")
+        if not self._followers_fetched():
+            return
 
         # Grab the list of new followers.
-        try:
-            self.state['new_followers'] = [fid for fid in self.api.followers_ids(self.id) if fid not in self.state['followers'] and self.api.get_user(fid).screen_name not in self.blacklist]
-        except tweepy.TweepError as e:
-            logging.error("Unable to update followers: %s (%s)" % (e[0]['message'], e[0]['code']))
-
-        # Invoke the callback.
-        for f in self.state['new_followers']:
-            self.state['followers'].append(f)
+        with self._api_errors("update followers", "follower update"):
+            self._set_new_followers(self._new_followers())
 
+        for f in self._each_new_follower():
             # Do we automatically follow back?
             if self.config['autofollow']:
                 self.create_friendship(f)
@@ -514,18 +871,244 @@ class PyBot(tweepy.StreamListener):
             # Callback.
             self.on_follow(f)
 
+    # The handlers above are shared with AsyncPyBot: everything but the
+    # API calls and callbacks is done in these helpers.
+
+    @contextlib.contextmanager
+    def _api_errors(self, doing, aborting):
+        """
+        Helper context manager that logs, rather than raises, the errors a
+        Twitter API call can fail with.
+        """
+        try:
+            yield
+        except tweepy.TweepError as e:
+            logging.error("Unable to %s: %s" % (doing, e))
+        except http.client.IncompleteRead as e:
+            logging.error("IncompleteRead error, aborting %s." % aborting)
+
+    def _timeline_tweets(self, timeline):
+        """
+        Helper generator over the (tweet, prefix) pairs to handle from a
+        fetched timeline, oldest first. Filters the timeline and records
+        the newest tweet's ID.
+        """
+        current_timeline = self._filter_timeline(timeline)
+        if len(current_timeline) > 0:
+            with self.state_lock:
+                self.state['last_timeline_id'] = current_timeline[0].id
+            for tweet in list(reversed(current_timeline)):
+                if self._first_sighting(tweet):
+                    yield tweet, self._mention_prefix(tweet)
+
+    def _mention_tweets(self, mentions):
+        """
+        Helper generator over the (tweet, prefix) pairs to handle from
+        fetched mentions, oldest first. Filters the mentions and records the
+        newest one's ID.
+        """
+        mentions = self._filter_mentions(mentions)
+        if len(mentions) > 0:
+            with self.state_lock:
+                self.state['last_mention_id'] = mentions[0].id
+            for mention in list(reversed(mentions)):
+                if self._first_sighting(mention):
+                    yield mention, self._mention_prefix(mention)
+
+    def _search_tweets(self):
+        """
+        Helper generator over the buffered stream tweets to handle, newest
+        first. Starts the stream instead, if it isn't running.
+        """
+        # Is the streamer even running?
+        if not self.stream.running:
+            self._start_stream()
+            return
+
+        # Take everything received so far.
+        tweets = self._stream_tweets()
+        logging.info("Received %s tweets from the streaming API, now processing." % len(tweets))
+        # Blacklisted authors were already dropped by the stream filters.
+        for tweet in reversed(tweets):
+            if self._first_sighting(tweet):
+                yield tweet
+
+    def _stream_tweets(self):
+        """
+        Helper method to take everything received from the streaming API so
+        far, leaving an empty buffer behind.
+        """
+        return self.drain_buffer()
+
+    def _followers_fetched(self):
+        """
+        Helper method to check that the bot's followers are known, so new
+        ones can be told apart.
+        """
+        if not self.graph_ready.is_set():
+            logging.info("Followers haven't been fetched yet, skipping.")
+            return False
+        return True
+
+    def _set_new_followers(self, new_followers):
+        """
+        Helper method to record followers still to be handled, so they
+        survive a restart.
+        """
+        with self.state_lock:
+            self.state['new_followers'] = new_followers
+
+    def _each_new_follower(self):
+        """
+        Helper generator over the new followers to handle. Once they all
+        have been, adds them to the bot's followers in one go (a single
+        merge, for an IdSet) and clears the list.
+        """
+        new_followers = list(self.state['new_followers'])
+        for f in new_followers:
+            yield f
+
         # Update the timestamps.
         logging.info("Followers updated")
-        if len(self.state['new_followers']) > 0:
-            logging.info("--%s new followers processed" % len(self.state['new_followers']))
-            self.state['new_followers'] = []
+        if len(new_followers) > 0:
+            logging.info("--%s new followers processed" % len(new_followers))
+            with self.state_lock:
+                self.state.add_ids('followers', new_followers)
+                self.state['new_followers'] = []
+
+    def _filter_timeline(self, timeline):
+        """
+        Helper method to drop timeline tweets this bot posted, tweets that
+        mention this bot, and tweets from blacklisted users.
+        """
+        current_timeline = []
+        for t in timeline:
+            if not self.matcher.is_self(t.author.screen_name) and \
+                    not self.matcher.is_blacklisted(t.author.screen_name) and \
+                    not self.matcher.mentions_self(t.text):
+                current_timeline.append(t)
+
+        # Do we ignore ALL mentions (tweets that mention OTHER users, NOT the bot)?
+        if self.config['ignore_timeline_mentions']:
+            current_timeline = [t for t in current_timeline if '@' not in t.text]
+        return current_timeline
+
+    def _filter_mentions(self, mentions):
+        """
+        Helper method to drop indirect mentions, if so configured.
+        """
+        if self.config['reply_direct_mention_only']:
+            mentions = [t for t in mentions if self.matcher.is_direct_mention(t.text)]
+        return mentions
+
+    def _start_stream(self):
+        """
+        Helper method to start the streaming API in the background.
+        """
+        # Are there any keywords we should be filtering on?
+        if len(self.config['search_keywords']) > 0:
+            # Yes, do a filter on the keywords.
+            logging.info("Starting the streaming filter.")
+            self.stream.filter(languages = self.config['languages'],
+                track = self.config['search_keywords'],
+                is_async = True)
+        else:
+            # Nope, just do a sample.
+            self.stream.sample(languages = self.config['languages'], is_async = True)
+            logging.info("Starting the streaming sample.")
+
+    def _new_followers(self):
+        """
+        Helper method to list followers that aren't in the bot's state yet,
+        excluding blacklisted users.
+        """
+        new_followers = self._fetch_ids(self.api.followers_ids) - self.state['followers']
+
+        # Only resolve screen names if there is a blacklist to check.
+        if len(new_followers) > 0 and len(self.matcher.blacklist) > 0:
+            new_followers -= set(u.id for u in self._lookup_users(new_followers) if self.matcher.is_blacklisted(u.screen_name))
+        return sorted(new_followers)
+
+    def _graph_interval(self):
+        """
+        Helper method giving the time until the next graph refresh: sooner
+        if the last one failed.
+        """
+        if self._graph_failed:
+            return self.config['graph_retry_interval']
+        return self.config['graph_ttl']
+
+    def _refresh_graph(self):
+        """
+        Fetches the IDs of the accounts this bot follows, and on first run
+        the IDs of its followers. Later follower changes are picked up by
+        the follow action, so that new followers still trigger `on_follow`.
+        Runs as the scheduled 'graph' action.
+        """
+        start = time.time()
+        try:
+            with self.state_lock:
+                before = self.state['friends'].copy()
+            friends = self._fetch_ids(self.api.friends_ids)
+            followers = None
+            if not self.graph_ready.is_set():
+                followers = self._fetch_ids(self.api.followers_ids)
+        except Exception as e:
+            logging.error("Unable to refresh social graph, retrying in %s seconds: %s" %
+                (self.config['graph_retry_interval'], e))
+            self._graph_failed = True
+            return
+        self._graph_failed = False
+
+        with self.state_lock:
+            # Log just what changed, keeping any follows made while the
+            # refresh was running.
+            current = self.state['friends']
+            self.state.add_ids('friends', friends - current)
+            self.state.remove_ids('friends', [i for i in before - friends if i in current])
+            if followers is not None:
+                self.state['followers'] = followers
+            self.state['graph_time'] = time.time()
+        self.graph_ready.set()
+        logging.info("Social graph refreshed in %.3f seconds (%s friends, %s followers)." %
+            (time.time() - start, len(self.state['friends']), len(self.state['followers'])))
+
+    def _id_set(self, ids):
+        """
+        Helper method to store a collection of user IDs as an IdSet or a set,
+        depending on `compact_ids`.
+        """
+        if self.config['compact_ids']:
+            return ids if isinstance(ids, IdSet) else IdSet(ids)
+        return ids if isinstance(ids, set) else set(ids)
+
+    def _fetch_ids(self, method):
+        """
+        Helper method to page through a friends_ids or followers_ids listing
+        for this bot, 5000 IDs at a time.
+        """
+        ids = self._id_set(())
+        for page in tweepy.Cursor(method, user_id = self.id).pages():
+            ids.update(page)
+        return ids
+
+    def _lookup_users(self, ids):
+        """
+        Helper method to resolve user IDs to tweepy.User objects, in batches
+        of up to 100 per API call.
+        """
+        ids = list(ids)
+        users = []
+        for i in range(0, len(ids), 100):
+            users += self.api.lookup_users(user_ids = ids[i:i + 100])
+        return users
 
     def _mention_prefix(self, tweet):
         """
         Helper method to get the list of mentions in a tweet for responding.
         """
         respond = ['@%s' % tweet.author.screen_name]
-        respond += [s for s in re.split('[^@\w]', tweet.text) if len(s) > 2 and s[0] == '@' and s[1:].lower() != self.screen_name.lower() and s[1:].lower() not in self.blacklist]
+        respond += self.matcher.mentions(tweet.text)
 
         if self.config['reply_followers_only']:
             # Delete any users who aren't a follower.
@@ -534,6 +1117,124 @@ class PyBot(tweepy.StreamListener):
         # Return the list as a string.
         return ' '.join(respond)
 
+    def _schedule_actions(self):
+        """
+        Adds each enabled built-in action to the scheduler, due at the time
+        recorded in the bot's state.
+        """
+        for action in self.actions:
+            interval = self.config['%s_interval' % action]
+            if interval != 0:
+                self.scheduler.schedule(action, getattr(self, '_handle_%s' % action),
+                    interval, when = self.state['next_%s_time' % action])
+
+        # Refresh the friends and followers now if they have never been
+        # fetched, otherwise once the cached copy gets too old.
+        self._graph_failed = False
+        when = 0
+        if self.graph_ready.is_set():
+            when = self.state['graph_time'] + self.config['graph_ttl']
+        self.scheduler.schedule('graph', self._refresh_graph, self._graph_interval, when = when)
+
+    def _has_actions(self):
+        """
+        Helper method to check whether any actions are left to run, besides
+        the graph refresh that only serves the others.
+        """
+        return len(self.scheduler) > int('graph' in self.scheduler)
+
+    def _defer(self, action, current_time):
+        """
+        Puts off a due action if its endpoint is out of rate limit budget.
+
+        Returns
+        -------
+        True if the action was deferred, False if it should run now.
+        """
+        endpoint = self.action_endpoints.get(action.name)
+        if endpoint is None:
+            return False
+        delay = self.governor.delay(endpoint)
+        if delay <= 0:
+            return False
+        logging.info("Deferring %s for %.1f seconds, %s is out of budget." % (action.name, delay, endpoint))
+        self.scheduler.reschedule(action.name, current_time + delay)
+        return True
+
+    def _dispatch(self, action, current_time):
+        """
+        Runs a due action and puts it back in the queue for its next run.
+        """
+        # Do something.
+        action.callback()
+        self._reschedule(action, current_time)
+
+    def _dispatch_done(self, future, action, current_time):
+        """
+        Completion callback for actions run in a worker thread. Puts the
+        action back in the queue and wakes up the run loop.
+        """
+        if future.exception() is not None:
+            logging.error("Action %s failed: %s" % (action.name, future.exception()))
+        self._reschedule(action, current_time)
+        self._wakeup.set()
+
+    def _reschedule(self, action, current_time):
+        """
+        Records that an action ran at `current_time` and queues its next run.
+        """
+        action.last_run = current_time
+        next_time = self._increment(current_time, action.interval)
+        # A `when` of 0 means "as soon as possible", which can't be late.
+        lag = max(0.0, current_time - action.when) if action.when > 0 else 0.0
+        with self.state_lock:
+            runs, total, worst = self._lags.get(action.name, (0, 0.0, 0.0))
+            self._lags[action.name] = (runs + 1, total + lag, max(worst, lag))
+            if action.name in self.actions:
+                self.state['last_%s_time' % action.name] = current_time
+                self.state['next_%s_time' % action.name] = next_time
+        if not action.cancelled:
+            self.scheduler.reschedule(action.name, next_time)
+
+    def _new_seen_cache(self):
+        """
+        Creates an empty cache of seen tweet IDs, as configured.
+        """
+        if self.config['seen_cache_size'] <= 0:
+            return None
+        return SeenCache(self.config['seen_cache_size'], self.config['seen_horizon'],
+            self.config['seen_error_rate'])
+
+    def _first_sighting(self, tweet):
+        """
+        Records a tweet as handled.
+
+        Returns
+        -------
+        True if no action has handled it before, False if one has.
+        """
+        seen = self.state['seen']
+        if seen is None:
+            return True
+        # The state key isn't touched here; see `_save_state`.
+        return seen.add(tweet.id)
+
+    def _seen_misses(self):
+        """
+        Number of tweet IDs the seen cache has taken, or None if disabled.
+        """
+        seen = self.state['seen']
+        return None if seen is None else seen.stats()['misses']
+
+    def _new_buffer(self):
+        """
+        Creates an empty streaming buffer, as configured.
+        """
+        if self.config['streaming_overflow'] == 'spill':
+            return SpillBuffer(self.config['streaming_buffer_length'], self.config['streaming_buffer_bytes'],
+                directory = self.config['streaming_spill_dir'], max_spill_bytes = self.config['streaming_spill_bytes'])
+        return RingBuffer(self.config['streaming_buffer_length'], self.config['streaming_buffer_bytes'])
+
     def _tweet_url(self, tweet):
         """
         Helper method for constructing a URL to a specific tweet.
@@ -559,16 +1260,64 @@ class PyBot(tweepy.StreamListener):
         self.running = False
         if self.stream.running:
             self.stream.disconnect()
-        self._save_state()
+        if self.writes is not None:
+            self.writes.stop(timeout = 5)
+        self._save_state(force = True)
         sys.exit()
 
-    def _save_state(self):
+    def _save_state(self, force = False):
         """
-        Serializes the current bot's state in case we halt.
+        Serializes the current bot's state in case we halt. Does nothing if
+        the state hasn't changed, or if the last save was less than
+        `save_interval` seconds ago (unless `force` is set).
         """
-        self.config['storage'].write('{}_state.pkl'.format(self.config['bot_name']), self.state)
+        with self.state_lock:
+            # The seen cache changes with nearly every tweet, so it's only
+            # written every `seen_save_interval` seconds, if it took new IDs.
+            last, misses = self._seen_save
+            if self._seen_misses() != misses and (force or
+                    time.time() >= last + self.config['seen_save_interval']):
+                self.state.touch('seen')
+                self._seen_save = (time.time(), self._seen_misses())
+            if not self.state.dirty:
+                return
+            if not force and time.time() < self._last_save + self.config['save_interval']:
+                return
+            # Take the changes before writing, so any made in the meantime
+            # stay marked for the next save.
+            storage = self.config['storage']
+            f = '{}_state.pkl'.format(self.config['bot_name'])
+            dirty, id_changes = self.state.take_changes()
+            try:
+                if getattr(storage, 'incremental', False):
+                    storage.write(f, self.state, dirty = dirty, id_changes = id_changes)
+                else:
+                    storage.write(f, self.state)
+            except:
+                self.state.restore_changes(dirty, id_changes)
+                raise
+            self._last_save = time.time()
         logging.info("Bot state saved.")
 
+    def _next_save_time(self):
+        """
+        When unsaved changes to the state are due to be written, or None if
+        there aren't any.
+        """
+        if not self.state.dirty:
+            return None
+        return self._last_save + self.config['save_interval']
+
+    def _next_wake_time(self):
+        """
+        When the run loop next has something to do: run an action or save.
+        """
+        next_action = self.scheduler.next_time()
+        save_time = self._next_save_time()
+        if save_time is not None and (next_action is None or save_time < next_action):
+            next_action = save_time
+        return next_action
+
     # # # # # # # # # # # # # # # # # # # # # # #
     #    Streaming methods. Leave these alone.  #
     # # # # # # # # # # # # # # # # # # # # # # #
@@ -576,24 +1325,301 @@ class PyBot(tweepy.StreamListener):
     def on_status(self, status):
         """
         Invoked whenever a new status arrives through the streaming listener,
-        whether from sample() or filter(). The status is appended to the buffer;
-        if the buffer length exceeds its limit, the oldest status is dropped.
+        whether from sample() or filter(). The status goes through the
+        `stream_filters` and `on_stream_status`, then is projected down to
+        the configured fields and appended to the buffer; if the buffer is
+        full, it's dropped or spilled to disk, per `streaming_overflow`.
         """
-        # Acquire the lock.
-        self.lock.acquire()
-
-        # Would adding this tweet to the buffer overflow it?
-        while len(self.buffer) >= self.config['streaming_buffer_length']:
-            self.buffer.pop(0)
-
-        # Append the new status
-        self.buffer.append(status)
-
-        # Release the lock.
-        self.lock.release()
+        status = self.stream_filters(status)
+        if status is None or self.on_stream_status(status) is False:
+            return
+        record = self.projection(status)
+        with self.lock:
+            self.buffer.append(record, record.nbytes)
+            high = (not self.buffer_overloaded and self.config['streaming_high_watermark'] > 0 and
+                len(self.buffer) >= self.config['streaming_high_watermark'])
+            if high:
+                self.buffer_overloaded = True
+                stats = self.buffer.stats()
+        if high:
+            self.on_buffer_high(stats)
 
     def on_error(self, status_code):
         pass
 
     def on_exception(self, exception):
         pass
+
+class AsyncPyBot(PyBot):
+    """
+    Variant of PyBot whose actions run as coroutines on a single asyncio
+    event loop, so that a slow action overlaps with the others instead of
+    delaying them.
+
+    tweepy's REST client is synchronous, so each API call runs on the
+    loop's default thread pool executor and is awaited from there. Statuses
+    from the streaming API are buffered just as in PyBot, then moved onto
+    `self.queue`, an asyncio.Queue, as they arrive; the search action takes
+    whatever is queued or buffered. To consume statuses as they come in instead, set
+    `search_interval` to 0, start the stream, and `await self.queue.get()`.
+    The queue holds up to `streaming_buffer_length` statuses; past that,
+    they wait in the buffer, where `streaming_overflow` applies.
+
+    Any of the `on_*` hooks, as well as custom callbacks, may be written as
+    `async def`. Plain functions also work; they are run in the executor so
+    they don't block the loop. From inside an `async def` hook, use the
+    `*_async` DSL methods (e.g. `await self.update_status_async(...)`).
+    """
+
+    # Queue of streamed statuses, and the loop feeding it, while running.
+    queue = None
+    _stream_loop = None
+
+    def run(self):
+        """
+        Starts the event loop and runs the bot on it until it stops.
+        """
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        """
+        AsyncPyBot's main coroutine. Use this instead of `run()` if you
+        already have an event loop going.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._async_wakeup = asyncio.Event()
+        self.queue = asyncio.Queue(maxsize = self.config['streaming_buffer_length'])
+        self._stream_ready = asyncio.Event()
+        self._stream_pending = False
+        self._stream_loop = self.loop
+        pump = asyncio.ensure_future(self._pump_stream())
+        tasks = set()
+
+        self.running = True
+        self._schedule_actions()
+        while self.running:
+            self._async_wakeup.clear()
+            current_time = time.time()
+
+            # Start everything that has come due, built-in and custom alike.
+            for action in self.scheduler.pop_due(current_time):
+                if self._defer(action, current_time):
+                    continue
+                task = asyncio.ensure_future(self._run_action(action, current_time))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            # Are there any more actions? Running ones count.
+            if not self._has_actions():
+                logging.warn("No actions are set! Switching bot OFF.")
+                self.running = False
+            else:
+                # Save the current state.
+                await self._call_api(self._save_state)
+
+                # Sleep until the next action (or pending save) is due, or
+                # until a running action finishes and requeues itself.
+                next_action = self._next_wake_time()
+                timeout = None if next_action is None else max(0, next_action - current_time)
+                if timeout is not None and timeout > 0:
+                    logging.info("Sleeping for %.4f seconds." % timeout)
+                try:
+                    await asyncio.wait_for(self._async_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Let whatever is still running finish up.
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+        pump.cancel()
+        self._stream_loop = None
+        logging.info("---SHUTDOWN---")
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #   Twitter DSL methods, for async hooks.   #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    async def update_status_async(self, status, reply_to = None, lat = None, lon = None):
+        """
+        Awaitable version of `update_status`.
+        """
+        return await self._await_write(self.update_status, status, reply_to = reply_to, lat = lat, lon = lon)
+
+    async def create_favorite_async(self, tweet):
+        """
+        Awaitable version of `create_favorite`.
+        """
+        return await self._await_write(self.create_favorite, tweet)
+
+    async def create_friendship_async(self, friend):
+        """
+        Awaitable version of `create_friendship`.
+        """
+        return await self._await_write(self.create_friendship, friend)
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #     Helper methods. Leave these alone.    #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    async def _handle_tweet(self):
+        """
+        Processes posting a tweet.
+        """
+        logging.info("Preparing for posting a new tweet...")
+        await self._invoke(self.on_tweet)
+        logging.info("Tweet completed")
+
+    async def _handle_timeline(self):
+        """
+        Processes the home timeline for the bot (excludes mentions).
+        """
+        logging.info("Reading current timeline...")
+        with self._api_errors("retrieve timeline", "timeline update"):
+            # Retrieve the last 500 posts on the timeline.
+            timeline = await self._call_api(self.api.home_timeline,
+                since_id = self.state['last_timeline_id'], count = 500)
+
+            for tweet, prefix in self._timeline_tweets(timeline):
+                # Run the tweet through the timeline callback.
+                await self._invoke(self.on_timeline, tweet, prefix)
+
+                # Check the tokens in the tweet for keywords.
+                if self.matcher.has_autofav_keyword(tweet.text):
+                    await self.create_favorite_async(tweet)
+
+        logging.info("Finished processing timeline.")
+
+    async def _handle_mention(self):
+        """
+        Processes the list of mentions for the bot.
+        """
+        logging.info("Checking for new mentions...")
+        with self._api_errors("retrieve mentions", "mentions"):
+            # Snag the last 100 mentions.
+            mentions = await self._call_api(self.api.mentions_timeline,
+                since_id = self.state['last_mention_id'], count = 100)
+
+            for mention, prefix in self._mention_tweets(mentions):
+                # Send the tweet to the callback.
+                await self._invoke(self.on_mention, mention, prefix)
+
+                # Do we autofav?
+                if self.config['autofav_direct_mentions']:
+                    await self.create_favorite_async(mention)
+
+        logging.info("Finished processing mentions.")
+
+    async def _handle_search(self):
+        """
+        Conducts a keyword search.
+        """
+        logging.info("Searching for keywords...")
+        for tweet in self._search_tweets():
+            await self._invoke(self.on_search, tweet)
+
+            # Test for autofav keywords.
+            if self.matcher.has_autofav_keyword(tweet.text):
+                await self.create_favorite_async(tweet)
+
+        logging.info("Search complete.")
+
+    async def _handle_follow(self):
+        """
+        Processes new followers and invokes the appropriate callback.
+        """
+        logging.info("Checking for new followers...")
+        if not self._followers_fetched():
+            return
+
+        # Grab the list of new followers.
+        with self._api_errors("update followers", "follower update"):
+            self._set_new_followers(await self._call_api(self._new_followers))
+
+        for f in self._each_new_follower():
+            # Do we automatically follow back?
+            if self.config['autofollow']:
+                await self.create_friendship_async(f)
+
+            # Callback.
+            await self._invoke(self.on_follow, f)
+
+    def _stream_tweets(self):
+        """
+        Helper method to take everything received from the streaming API so
+        far: what's queued, then what's still buffered.
+        """
+        tweets = []
+        while self.queue is not None and not self.queue.empty():
+            tweets.append(self.queue.get_nowait())
+        tweets.extend(self.drain_buffer())
+        return tweets
+
+    async def _pump_stream(self):
+        """
+        Moves statuses from the streaming buffer onto the queue whenever the
+        stream signals new ones, waiting while the queue is full.
+        """
+        while True:
+            await self._stream_ready.wait()
+            self._stream_ready.clear()
+            self._stream_pending = False
+            for record in self.drain_buffer():
+                await self.queue.put(record)
+
+    async def _run_action(self, action, current_time):
+        """
+        Runs a due action, puts it back in the queue for its next run, and
+        wakes up the run loop.
+        """
+        try:
+            await self._invoke(action.callback)
+        except Exception as e:
+            logging.error("Action %s failed: %s" % (action.name, e))
+        self._reschedule(action, current_time)
+        self._async_wakeup.set()
+
+    async def _await_write(self, function, *args, **kwargs):
+        """
+        Helper method to run a DSL method in the executor and, if it queued
+        the write, await the write too.
+        """
+        result = await self._call_api(function, *args, **kwargs)
+        if isinstance(result, concurrent.futures.Future):
+            result = await asyncio.wrap_future(result)
+        return result
+
+    async def _invoke(self, function, *args):
+        """
+        Helper method to call a hook that may or may not be a coroutine
+        function. Plain functions are run in the executor.
+        """
+        if asyncio.iscoroutinefunction(function):
+            return await function(*args)
+        return await self._call_api(function, *args)
+
+    async def _call_api(self, function, *args, **kwargs):
+        """
+        Helper method to run a blocking call in the executor and await it.
+        Like asyncio.to_thread, it runs in a copy of the caller's context, so
+        context variables carry over.
+        """
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(context.run, function, *args, **kwargs))
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #    Streaming methods. Leave these alone.  #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    def on_status(self, status):
+        """
+        Invoked on the streaming thread whenever a new status arrives. The
+        status is buffered as in PyBot, then the event loop is told to move
+        it onto the queue; only once per batch, so a busy stream doesn't
+        flood the loop with callbacks.
+        """
+        PyBot.on_status(self, status)
+        loop = self._stream_loop
+        if loop is not None and not self._stream_pending:
+            self._stream_pending = True
+            loop.call_soon_threadsafe(self._stream_ready.set)
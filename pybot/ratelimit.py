@@ -0,0 +1,220 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import functools
+import logging
+import threading
+import time
+
+# Twitter's published limits for the endpoints PyBot uses, as (number of
+# calls, per this many seconds). Read limits are per 15-minute window.
+DEFAULT_API_LIMITS = {
+    'home_timeline': (15, 15 * 60),
+    'mentions_timeline': (75, 15 * 60),
+    'followers_ids': (15, 15 * 60),
+    'friends_ids': (15, 15 * 60),
+    'get_user': (900, 15 * 60),
+    'lookup_users': (900, 15 * 60),
+    'update_status': (300, 3 * 60 * 60),
+    'create_favorite': (1000, 24 * 60 * 60),
+    'create_friendship': (400, 24 * 60 * 60),
+}
+
+class TokenBucket(object):
+    """
+    Token bucket for a single endpoint, refilled at `calls / period` tokens
+    per second up to `calls`. When Twitter reports how many calls are left
+    in the current window, the bucket never hands out more than that.
+    """
+
+    def __init__(self, calls, period):
+        self.capacity = float(calls)
+        self.period = float(period)
+        self.tokens = float(calls)
+        self.updated = time.time()
+
+        # Budget reported by Twitter for its current window, if any.
+        self.remaining = None
+        self.reset = 0
+
+    def delay(self, now):
+        """
+        Seconds until a call can be made, or 0 if one can be made now.
+        """
+        self._refill(now)
+        if self.remaining is not None and now < self.reset and self.remaining < 1:
+            return self.reset - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) * self.period / self.capacity
+
+    def take(self, now):
+        """
+        Spends a token.
+        """
+        self._refill(now)
+        self.tokens -= 1
+        if self.remaining is not None and now < self.reset:
+            self.remaining -= 1
+
+    def observe(self, remaining, limit, reset, now):
+        """
+        Adjusts the bucket to the budget Twitter reported.
+        """
+        if limit is not None and limit > 0:
+            self.capacity = float(limit)
+        if remaining is not None and reset is not None:
+            self.remaining = remaining
+            self.reset = reset
+            self.tokens = min(self.tokens, float(remaining))
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.period)
+        self.updated = now
+
+class RateGovernor(object):
+    """
+    Tracks the remaining call budget for each rate-limited endpoint and
+    spaces calls out so they stay within it.
+
+    Budgets start from the configured limits and are corrected from the
+    x-rate-limit-* headers of each response. A 429 response empties the
+    bucket until the window resets.
+    """
+
+    def __init__(self, limits = None):
+        """
+        Parameters
+        ----------
+        limits : dict or None
+            Maps endpoint names to (calls, seconds) tuples. Defaults to
+            DEFAULT_API_LIMITS.
+        """
+        self.limits = DEFAULT_API_LIMITS if limits is None else limits
+        self._buckets = {e: TokenBucket(c, p) for e, (c, p) in self.limits.items()}
+        self._lock = threading.Lock()
+
+    def __contains__(self, endpoint):
+        return endpoint in self._buckets
+
+    def delay(self, endpoint):
+        """
+        Seconds until `endpoint` can be called, or 0 if it can be called now
+        (or isn't rate limited).
+        """
+        if endpoint not in self._buckets:
+            return 0
+        with self._lock:
+            return self._buckets[endpoint].delay(time.time())
+
+    def acquire(self, endpoint):
+        """
+        Blocks until `endpoint` can be called, then spends a token.
+        """
+        if endpoint not in self._buckets:
+            return
+        bucket = self._buckets[endpoint]
+        while True:
+            with self._lock:
+                now = time.time()
+                wait = bucket.delay(now)
+                if wait <= 0:
+                    bucket.take(now)
+                    return
+            logging.info("Waiting %.1f seconds for the %s rate limit." % (wait, endpoint))
+            time.sleep(wait)
+
+    def observe(self, endpoint, response):
+        """
+        Updates the budget of `endpoint` from an HTTP response.
+
+        Parameters
+        ----------
+        endpoint : string
+            Endpoint that was called.
+        response : requests.Response or None
+            Response to the call, with its rate limit headers.
+        """
+        if endpoint not in self._buckets or response is None:
+            return
+        headers = getattr(response, 'headers', {})
+        remaining = _int_header(headers, 'x-rate-limit-remaining')
+        limit = _int_header(headers, 'x-rate-limit-limit')
+        reset = _int_header(headers, 'x-rate-limit-reset')
+        if getattr(response, 'status_code', None) == 429:
+            remaining = 0
+            if reset is None:
+                reset = time.time() + self._buckets[endpoint].period
+        with self._lock:
+            self._buckets[endpoint].observe(remaining, limit, reset, time.time())
+
+    def budget(self, endpoint):
+        """
+        Returns
+        -------
+        Dict with the `tokens` currently available to `endpoint`, the bucket
+        `capacity`, and the `remaining` calls and `reset` time Twitter last
+        reported (None and 0 if it hasn't yet).
+        """
+        with self._lock:
+            bucket = self._buckets[endpoint]
+            bucket.delay(time.time())
+            return {
+                'tokens': bucket.tokens,
+                'capacity': bucket.capacity,
+                'remaining': bucket.remaining,
+                'reset': bucket.reset,
+            }
+
+    def budgets(self):
+        """
+        Returns `budget()` for every rate-limited endpoint.
+        """
+        return {e: self.budget(e) for e in self._buckets}
+
+class GovernedAPI(object):
+    """
+    Wraps a tweepy.API so that calls to rate-limited endpoints wait for the
+    governor's go-ahead and report their responses back to it. Everything
+    else passes straight through.
+
+    Responses are read from tweepy's `api.last_response`, which is shared
+    by all threads; under heavy concurrency an update may be attributed to
+    the wrong call, which the next response corrects.
+    """
+
+    def __init__(self, api, governor):
+        self.api = api
+        self.governor = governor
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name not in self.governor or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            self.governor.acquire(name)
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.governor.observe(name, getattr(self.api, 'last_response', None))
+        return call
+
+def _int_header(headers, name):
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
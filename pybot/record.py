@@ -0,0 +1,140 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sys
+
+# Fields the framework itself reads from streamed tweets.
+DEFAULT_FIELDS = (
+    'id',
+    'id_str',
+    'text',
+    'lang',
+    'created_at',
+    'in_reply_to_screen_name',
+    'author.id',
+    'author.screen_name',
+    'user.id',
+    'user.screen_name',
+)
+
+# Rough in-memory footprint of a full tweepy.Status, with its nested user
+# model and raw JSON, for byte-capping buffers that keep them.
+FULL_STATUS_BYTES = 16 * 1024
+
+class TweetRecord(object):
+    """
+    Compact copy of selected fields of a tweepy.Status. Subclasses with the
+    actual fields as __slots__ are generated by `Projection`.
+
+    Reading a field that wasn't projected raises AttributeError, unless the
+    full status was kept, in which case it's read from there.
+
+    Records can be pickled, e.g. to spill them to disk.
+    """
+    __slots__ = ('_status', 'nbytes')
+
+    def __getattr__(self, name):
+        # Only reached for names that aren't slots of the record.
+        status = object.__getattribute__(self, '_status')
+        if status is None:
+            raise AttributeError("'%s' was not among the projected stream fields." % name)
+        return getattr(status, name)
+
+    @property
+    def status(self):
+        """
+        The full tweepy.Status, if it was kept; None otherwise.
+        """
+        return self._status
+
+    def __reduce__(self):
+        cls = type(self)
+        values = tuple(getattr(self, name) for name in cls.__slots__)
+        return (_restore, (cls.__name__, cls.__slots__, values, self._status, self.nbytes))
+
+class Projection(object):
+    """
+    Turns tweepy.Status objects into TweetRecords holding just the given
+    fields. Dotted fields, such as "user.screen_name", become nested
+    records.
+    """
+
+    def __init__(self, fields = DEFAULT_FIELDS, keep_full = False, name = 'TweetRecord'):
+        """
+        Parameters
+        ----------
+        fields : list of strings
+            Attribute paths to copy from each status.
+        keep_full : boolean
+            If True, each record also holds a reference to its full status.
+        """
+        self.keep_full = keep_full
+        self._leaves = []
+        self._nested = {}
+        groups = {}
+        for field in fields:
+            head, _, rest = field.partition('.')
+            if rest:
+                groups.setdefault(head, []).append(rest)
+            elif head not in self._leaves:
+                self._leaves.append(head)
+        for head, rest in groups.items():
+            if head in self._leaves:
+                self._leaves.remove(head)
+            self._nested[head] = Projection(rest, name = '%s_%s' % (name, head))
+        self.record_class = _record_class(name, tuple(self._leaves) + tuple(self._nested))
+
+    def __call__(self, status):
+        """
+        Projects `status` into a record. Missing attributes become None.
+        """
+        record = self.record_class.__new__(self.record_class)
+        nbytes = sys.getsizeof(record)
+        for name in self._leaves:
+            value = getattr(status, name, None)
+            setattr(record, name, value)
+            nbytes += sys.getsizeof(value)
+        for name, projection in self._nested.items():
+            value = getattr(status, name, None)
+            if value is not None:
+                value = projection(value)
+                nbytes += value.nbytes
+            setattr(record, name, value)
+        record._status = status if self.keep_full else None
+        if self.keep_full:
+            nbytes += FULL_STATUS_BYTES
+        record.nbytes = nbytes
+        return record
+
+_record_classes = {}
+
+def _record_class(name, slots):
+    """
+    Returns the TweetRecord subclass with the given fields, creating it the
+    first time it's asked for.
+    """
+    cls = _record_classes.get((name, slots))
+    if cls is None:
+        cls = type(name, (TweetRecord,), {'__slots__': slots})
+        _record_classes[(name, slots)] = cls
+    return cls
+
+def _restore(name, slots, values, status, nbytes):
+    cls = _record_class(name, slots)
+    record = cls.__new__(cls)
+    for slot, value in zip(slots, values):
+        setattr(record, slot, value)
+    record._status = status
+    record.nbytes = nbytes
+    return record
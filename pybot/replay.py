@@ -0,0 +1,327 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import collections
+import contextvars
+import functools
+import gzip
+import json
+import logging
+import threading
+import time
+import types
+
+import tweepy
+
+# REST endpoints whose responses are recorded and replayed.
+RECORDED_ENDPOINTS = ('home_timeline', 'mentions_timeline', 'followers_ids', 'friends_ids')
+
+# Bot actions whose runs are recorded and replayed; 'graph' is the
+# scheduled refresh of the bot's friends and followers.
+RECORDED_ACTIONS = ('timeline', 'mention', 'search', 'follow', 'tweet', 'graph')
+
+# Action being recorded, in whichever thread or task is running it.
+_current_action = contextvars.ContextVar('pybot_recorded_action', default = None)
+
+class Recorder(object):
+    """
+    Records a live bot's traffic to a gzipped JSON lines log: every status
+    its streaming listener receives, the responses to the REST endpoints in
+    RECORDED_ENDPOINTS (each tagged with the action that made the call),
+    and when each of its actions ran. A Replayer can then feed the log back
+    through a bot offline.
+
+    Attach the recorder before calling the bot's `run()`.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : string
+            File to write the log to. Overwritten if it exists.
+        """
+        self.path = path
+        self.counts = collections.Counter()
+        self._file = gzip.open(path, 'wt', encoding = 'utf8')
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def attach(self, bot):
+        """
+        Starts recording `bot`'s traffic.
+        """
+        bot.api = _RecordingAPI(bot.api, self)
+
+        on_status = bot.on_status
+        def record_status(status):
+            self.record('status', _encode(status))
+            return on_status(status)
+        bot.on_status = record_status
+
+        for name in RECORDED_ACTIONS:
+            attr = _action_method(name)
+            setattr(bot, attr, self._recording_action(name, getattr(bot, attr)))
+
+    def record(self, kind, data, name = None, action = None):
+        """
+        Appends an entry to the log.
+        """
+        entry = {'t': round(time.time() - self._start, 6), 'kind': kind, 'data': data}
+        if name is not None:
+            entry['name'] = name
+        if action is not None:
+            entry['action'] = action
+        line = json.dumps(entry, separators = (',', ':'))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.write('\n')
+            self.counts[kind if name is None else name] += 1
+
+    def close(self):
+        """
+        Finishes the log.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _recording_action(self, name, handler):
+        # Runs are logged once they're done, so they come after their
+        # responses.
+        if asyncio.iscoroutinefunction(handler):
+            @functools.wraps(handler)
+            async def run_async(*args, **kwargs):
+                token = _current_action.set(name)
+                try:
+                    return await handler(*args, **kwargs)
+                finally:
+                    _current_action.reset(token)
+                    self.record('action', None, name)
+            return run_async
+
+        @functools.wraps(handler)
+        def run(*args, **kwargs):
+            token = _current_action.set(name)
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                _current_action.reset(token)
+                self.record('action', None, name)
+        return run
+
+class _RecordingAPI(object):
+    """
+    Wraps a bot's API object, logging the responses of recorded endpoints.
+    """
+
+    def __init__(self, api, recorder):
+        self.api = api
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self.api, name)
+        if name not in RECORDED_ENDPOINTS or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            self.recorder.record('response', _encode(result), name, _current_action.get())
+            return result
+        return call
+
+class Replayer(object):
+    """
+    Feeds a Recorder's log back through a bot, without touching Twitter.
+
+    Statuses go to the bot's `on_status`, as from the streaming API.
+    Recorded REST responses are queued up and handed out, in order, to the
+    bot's calls to the same endpoints from the same action that made them.
+    Each recorded action is run again at the point in the log where it
+    originally finished; in particular the bot's followers count as
+    fetched once the recorded graph refresh has been replayed, as they did
+    live. Calls to any other endpoint (e.g. update_status) are counted in
+    `calls` and not made.
+
+    Works with AsyncPyBot too; its actions are run to completion on the
+    bot's event loop, one at a time.
+    """
+
+    def __init__(self, path, speed = 0):
+        """
+        Parameters
+        ----------
+        path : string
+            Log written by a Recorder.
+        speed : float
+            How fast to replay, relative to how the log was recorded: 1 for
+            real time, 10 for ten times as fast, and so on. 0 replays as
+            fast as possible.
+        """
+        self.path = path
+        self.speed = speed
+        self.calls = collections.Counter()
+        self._responses = collections.defaultdict(collections.deque)
+        self._action = None
+
+    def attach(self, bot):
+        """
+        Points `bot` at the replayed traffic instead of Twitter.
+        """
+        bot.api = _ReplayAPI(self, bot)
+        bot.stream = _ReplayStream()
+        if not hasattr(bot, 'loop'):
+            bot.loop = asyncio.new_event_loop()
+
+    def run(self, bot):
+        """
+        Replays the whole log through `bot`, which must have been attached.
+
+        Returns
+        -------
+        Dict with the number of `statuses` fed in, `responses` queued up,
+        `actions` run (by name), the `elapsed` seconds, and the `rate` of
+        log entries processed per second.
+        """
+        stats = {'statuses': 0, 'responses': 0, 'actions': collections.Counter()}
+        entries = 0
+        start = time.time()
+        for entry in self.entries():
+            if self.speed > 0:
+                delay = start + entry['t'] / self.speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            kind = entry['kind']
+            if kind == 'status':
+                bot.on_status(_decode(entry['data']))
+                stats['statuses'] += 1
+            elif kind == 'response':
+                self._responses[entry.get('action'), entry['name']].append(entry['data'])
+                stats['responses'] += 1
+            elif kind == 'action':
+                name = entry['name']
+                self._action = name
+                try:
+                    result = getattr(bot, _action_method(name))()
+                    if asyncio.iscoroutine(result):
+                        bot.loop.run_until_complete(result)
+                finally:
+                    self._action = None
+                stats['actions'][name] += 1
+            entries += 1
+
+        stats['elapsed'] = time.time() - start
+        stats['rate'] = entries / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+        logging.info("Replayed %s log entries in %.3f seconds." % (entries, stats['elapsed']))
+        return stats
+
+    def entries(self):
+        """
+        Iterates over the log's entries, in order.
+        """
+        with gzip.open(self.path, 'rt', encoding = 'utf8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def _next_response(self, name):
+        """
+        Hands out the next response recorded from `name` for the action
+        being replayed (or, from logs without action tags, for any action),
+        or an empty one if there are none left.
+        """
+        for key in ((self._action, name), (None, name)):
+            queue = self._responses[key]
+            if len(queue) > 0:
+                return _decode(queue.popleft())
+        if name in ('followers_ids', 'friends_ids'):
+            return [], (0, 0)
+        return []
+
+class _ReplayAPI(object):
+    """
+    Stands in for a bot's API object during a replay.
+    """
+
+    def __init__(self, replayer, bot):
+        self.replayer = replayer
+        self.bot = bot
+
+    def __getattr__(self, name):
+        if name in RECORDED_ENDPOINTS:
+            def call(*args, **kwargs):
+                return self.replayer._next_response(name)
+            if name in ('followers_ids', 'friends_ids'):
+                call.pagination_mode = 'cursor'
+            return call
+
+        def call(*args, **kwargs):
+            self.replayer.calls[name] += 1
+            if name == 'update_status':
+                return types.SimpleNamespace(id = 0, text = kwargs.get('status'),
+                    author = types.SimpleNamespace(screen_name = self.bot.screen_name))
+            return None
+        return call
+
+class _ReplayStream(object):
+    """
+    Stands in for a bot's tweepy.Stream during a replay: always running.
+    """
+    running = True
+
+    def filter(self, *args, **kwargs):
+        pass
+
+    def sample(self, *args, **kwargs):
+        pass
+
+    def disconnect(self):
+        pass
+
+def _action_method(name):
+    """
+    Name of the bot method that runs an action.
+    """
+    return '_refresh_graph' if name == 'graph' else '_handle_%s' % name
+
+def _encode(value):
+    """
+    Converts an API result to something json.dumps can handle. tweepy
+    models are stored as the JSON Twitter sent for them.
+    """
+    if hasattr(value, '_json'):
+        return {'_json': value._json}
+    if isinstance(value, tuple):
+        return {'_tuple': [_encode(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+def _decode(value):
+    """
+    Reverses `_encode`, parsing stored JSON back into tweepy.Status objects.
+    """
+    if isinstance(value, dict):
+        if '_json' in value:
+            return tweepy.Status.parse(None, value['_json'])
+        if '_tuple' in value:
+            return tuple(_decode(v) for v in value['_tuple'])
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
@@ -0,0 +1,213 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import heapq
+import itertools
+import threading
+
+class ScheduledAction(object):
+    """
+    A single entry in the Scheduler: something to call, how often to call it,
+    and when it is next due. `name` is the key the action was registered
+    under, minus any namespace.
+    """
+    __slots__ = ('key', 'name', 'callback', 'interval', 'when', 'last_run', 'seq', 'cancelled')
+
+    def __init__(self, key, callback, interval, when, name = None):
+        self.key = key
+        self.name = key if name is None else name
+        self.callback = callback
+        self.interval = interval
+        self.when = when
+        self.last_run = 0
+        self.seq = None
+        self.cancelled = False
+
+class Scheduler(object):
+    """
+    Priority queue of timed actions, ordered by the time each is next due.
+
+    Insertion and popping the next due action are both O(log n). Cancelled
+    and rescheduled actions leave stale entries in the heap, which are
+    discarded lazily as they reach the top. All public methods are safe to
+    call from multiple threads.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._actions = {}
+        self._counter = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._actions)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._actions
+
+    def get(self, key):
+        """
+        Returns the ScheduledAction registered under `key`, or None.
+        """
+        with self._lock:
+            return self._actions.get(key)
+
+    def actions(self):
+        """
+        Lists every registered ScheduledAction, queued or running.
+        """
+        with self._lock:
+            return list(self._actions.values())
+
+    def namespace(self, namespace):
+        """
+        Returns a view of this scheduler whose keys are implicitly prefixed
+        with `namespace`, so several owners can share one queue.
+        """
+        return SchedulerNamespace(self, namespace)
+
+    def schedule(self, key, callback, interval, when = 0, name = None):
+        """
+        Registers an action. Any action already registered under the same
+        key is cancelled and replaced.
+
+        Parameters
+        ----------
+        key : hashable
+            Unique identifier for the action.
+        callback : function
+            Function to invoke when the action is due.
+        interval : integer or callable
+            Number of seconds between runs, or a callable that returns it.
+        when : float
+            Timestamp at which the action is first due.
+        name : hashable or None
+            Name of the action within its namespace. Defaults to `key`.
+
+        Returns
+        -------
+        The new ScheduledAction.
+        """
+        with self._lock:
+            self.cancel(key)
+            action = ScheduledAction(key, callback, interval, when, name = name)
+            self._actions[key] = action
+            self._push(action)
+            return action
+
+    def cancel(self, key):
+        """
+        Removes an action. Safe to call while the action is running; it will
+        simply not be rescheduled.
+
+        Returns
+        -------
+        True if the action was registered, False otherwise.
+        """
+        with self._lock:
+            action = self._actions.pop(key, None)
+            if action is None:
+                return False
+            action.cancelled = True
+            action.seq = None
+            return True
+
+    def reschedule(self, key, when):
+        """
+        Moves an action to a new due time.
+
+        Returns
+        -------
+        True if the action was registered, False otherwise.
+        """
+        with self._lock:
+            action = self._actions.get(key)
+            if action is None:
+                return False
+            action.when = when
+            self._push(action)
+            return True
+
+    def next_time(self):
+        """
+        Timestamp of the next due action, or None if nothing is scheduled.
+        """
+        with self._lock:
+            self._prune()
+            return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def pop_due(self, current_time):
+        """
+        Pops every action due strictly before `current_time`, in order.
+        Popped actions stay registered (and cancellable) but are not in the
+        queue again until they are rescheduled.
+        """
+        due = []
+        with self._lock:
+            self._prune()
+            while len(self._heap) > 0 and self._heap[0][0] < current_time:
+                action = heapq.heappop(self._heap)[2]
+                action.seq = None
+                due.append(action)
+                self._prune()
+        return due
+
+    def _push(self, action):
+        action.seq = next(self._counter)
+        heapq.heappush(self._heap, (action.when, action.seq, action))
+
+    def _prune(self):
+        """
+        Discards stale heap entries (cancelled or since rescheduled).
+        """
+        heap = self._heap
+        while len(heap) > 0 and heap[0][2].seq != heap[0][1]:
+            heapq.heappop(heap)
+
+class SchedulerNamespace(object):
+    """
+    View of a Scheduler that stores every key as `(namespace, key)`. It
+    offers the same methods as Scheduler, restricted to its own actions.
+    """
+
+    def __init__(self, scheduler, namespace):
+        self.scheduler = scheduler
+        self.namespace = namespace
+
+    def __len__(self):
+        return len(self.actions())
+
+    def __contains__(self, key):
+        return (self.namespace, key) in self.scheduler
+
+    def get(self, key):
+        return self.scheduler.get((self.namespace, key))
+
+    def actions(self):
+        return [a for a in self.scheduler.actions() if a.key[0] == self.namespace]
+
+    def schedule(self, key, callback, interval, when = 0):
+        return self.scheduler.schedule((self.namespace, key), callback, interval, when = when, name = key)
+
+    def cancel(self, key):
+        return self.scheduler.cancel((self.namespace, key))
+
+    def reschedule(self, key, when):
+        return self.scheduler.reschedule((self.namespace, key), when)
+
+    def next_time(self):
+        times = [a.when for a in self.actions() if a.seq is not None]
+        return min(times) if len(times) > 0 else None
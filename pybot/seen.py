@@ -0,0 +1,178 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import collections
+import math
+import threading
+
+_MASK = (1 << 64) - 1
+
+def _mix(x):
+    """
+    splitmix64 finalizer: scrambles a 64-bit integer.
+    """
+    z = (x + 0x9E3779B97F4A7C15) & _MASK
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK
+    return z ^ (z >> 31)
+
+class BloomFilter(object):
+    """
+    Bloom filter of 64-bit integers, sized for `capacity` items at a false
+    positive rate of `error_rate`.
+    """
+
+    def __init__(self, capacity, error_rate = 0.001):
+        self.nbits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.nhashes = max(1, int(round(self.nbits / capacity * math.log(2))))
+        self.count = 0
+        self.bits = bytearray((self.nbits + 7) // 8)
+
+    def _indexes(self, x):
+        z = _mix(x & _MASK)
+        h1, h2 = z & 0xFFFFFFFF, (z >> 32) | 1
+        for i in range(self.nhashes):
+            yield (h1 + i * h2) % self.nbits
+
+    def __contains__(self, x):
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(x))
+
+    def add(self, x):
+        bits = self.bits
+        for i in self._indexes(x):
+            bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+class SeenCache(object):
+    """
+    Remembers which tweet IDs have been handled, so the same tweet isn't
+    processed twice, whether it turns up in more than one action or again
+    after a restart.
+
+    The most recent `capacity` IDs are kept exactly, in an LRU. Beyond
+    that, IDs are remembered for a longer horizon by two generations of
+    Bloom filters, each holding up to half of `horizon` IDs; when the newer
+    one fills up, the older one is discarded. A Bloom filter can mistake a
+    new ID for a seen one, at a rate of about `error_rate`.
+
+    Pickles compactly, as packed arrays and bit strings.
+    """
+
+    def __init__(self, capacity = 100000, horizon = 1000000, error_rate = 0.001):
+        """
+        Parameters
+        ----------
+        capacity : integer
+            Number of IDs kept exactly.
+        horizon : integer
+            Number of IDs remembered, approximately, by the Bloom filters.
+        error_rate : float
+            Rate at which new IDs are mistaken for seen ones.
+        """
+        self.capacity = capacity
+        self.horizon = horizon
+        self.error_rate = error_rate
+        self.hits = 0
+        self.misses = 0
+        self._recent = collections.OrderedDict()
+        self._blooms = [self._new_bloom(), self._new_bloom()]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._recent)
+
+    def __contains__(self, tweet_id):
+        with self._lock:
+            return self._seen(tweet_id)
+
+    def add(self, tweet_id):
+        """
+        Records `tweet_id` as seen.
+
+        Returns
+        -------
+        True if it hadn't been seen before, False if it had.
+        """
+        with self._lock:
+            new = not self._seen(tweet_id)
+            if new:
+                self.misses += 1
+                if self._blooms[0].count >= self.horizon // 2:
+                    self._blooms = [self._new_bloom(), self._blooms[0]]
+                self._blooms[0].add(tweet_id)
+            else:
+                self.hits += 1
+
+            self._recent[tweet_id] = None
+            self._recent.move_to_end(tweet_id)
+            if len(self._recent) > self.capacity:
+                self._recent.popitem(last = False)
+            return new
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the number of `hits` (IDs already seen) and `misses`,
+        the `hit_rate`, and the number of IDs held exactly (`recent`) and in
+        the Bloom filters (`bloom`).
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'recent': len(self._recent),
+                'bloom': sum(b.count for b in self._blooms),
+            }
+
+    def __getstate__(self):
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'horizon': self.horizon,
+                'error_rate': self.error_rate,
+                'hits': self.hits,
+                'misses': self.misses,
+                'recent': array.array('q', self._recent).tobytes(),
+                'blooms': [(b.count, bytes(b.bits)) for b in self._blooms],
+            }
+
+    def __setstate__(self, state):
+        self.capacity = state['capacity']
+        self.horizon = state['horizon']
+        self.error_rate = state['error_rate']
+        self.hits = state['hits']
+        self.misses = state['misses']
+        recent = array.array('q')
+        recent.frombytes(state['recent'])
+        self._recent = collections.OrderedDict.fromkeys(recent)
+        self._blooms = []
+        for count, bits in state['blooms']:
+            bloom = self._new_bloom()
+            bloom.count = count
+            bloom.bits = bytearray(bits)
+            self._blooms.append(bloom)
+        self._lock = threading.Lock()
+
+    def _new_bloom(self):
+        # Either generation can produce a false positive, so each gets half
+        # of the error budget.
+        return BloomFilter(max(1, self.horizon // 2), self.error_rate / 2)
+
+    def _seen(self, tweet_id):
+        return tweet_id in self._recent or any(tweet_id in b for b in self._blooms)
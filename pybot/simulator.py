@@ -0,0 +1,418 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import itertools
+import logging
+import random
+import threading
+import time
+
+import tweepy
+
+from .ratelimit import DEFAULT_API_LIMITS
+
+_WORDS = ('the', 'a', 'bot', 'python', 'data', 'coffee', 'today', 'new', 'love', 'great',
+    'time', 'people', 'think', 'good', 'day', 'world', 'music', 'game', 'news', 'happy')
+
+class SimulatedTwitter(object):
+    """
+    In-process stand-in for Twitter, for load testing bots without the
+    network. Pass it to a bot as its API client, and its `stream` method as
+    the stream factory:
+
+        sim = SimulatedTwitter(stream_rate = 500)
+        bot = MyBot(api_client = sim, stream_factory = sim.stream)
+
+    The simulated world moves on in real time: tweets from the bot's
+    friends land on its home timeline, other users mention it, followers
+    come and go, and the streaming API delivers statuses at `stream_rate`
+    per second. Every call takes `latency` seconds on average, fails with
+    probability `error_rate`, and counts against a fixed rate limit window,
+    with Twitter's x-rate-limit-* headers reported in `last_response`.
+    """
+
+    def __init__(self, screen_name = 'pybot', user_id = 1, users = 10000, followers = 1000,
+            friends = 500, timeline_rate = 0.5, mention_rate = 0.05, follow_rate = 0.01,
+            unfollow_rate = 0.005, stream_rate = 50, latency = 0.05, error_rate = 0.0,
+            rate_limits = None, seed = None):
+        """
+        Parameters
+        ----------
+        screen_name : string
+            The bot's screen name.
+        user_id : integer
+            The bot's user ID.
+        users : integer
+            Number of other users in the simulated world.
+        followers, friends : integer
+            Number of users following, and followed by, the bot at the start.
+        timeline_rate, mention_rate : float
+            Tweets per second arriving on the home timeline, and mentioning
+            the bot.
+        follow_rate, unfollow_rate : float
+            Followers gained and lost per second.
+        stream_rate : float
+            Statuses per second delivered by the streaming API.
+        latency : float
+            Mean time each API call takes, in seconds.
+        error_rate : float
+            Probability that an API call fails.
+        rate_limits : dict or None
+            Maps endpoint names to (calls, seconds) windows. Defaults to
+            pybot.ratelimit.DEFAULT_API_LIMITS.
+        seed : integer
+            Random seed, for repeatable runs.
+        """
+        self.screen_name = screen_name
+        self.user_id = user_id
+        self.users = users
+        self.timeline_rate = timeline_rate
+        self.mention_rate = mention_rate
+        self.follow_rate = follow_rate
+        self.unfollow_rate = unfollow_rate
+        self.stream_rate = stream_rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limits = DEFAULT_API_LIMITS if rate_limits is None else rate_limits
+        self.last_response = None
+
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.rate_limited = collections.Counter()
+        self.streamed = 0
+
+        self._random = random.Random(seed)
+        self._ids = itertools.count(10 ** 15)
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._followers = set(self._random.sample(range(1000, 1000 + users), min(followers, users)))
+        self._friends = set(self._random.sample(range(1000, 1000 + users), min(friends, users)))
+        self._timeline = collections.deque(maxlen = 800)
+        self._mentions = collections.deque(maxlen = 800)
+        self._updated = time.time()
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #       The subset of tweepy.API used.      #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    def me(self):
+        self._call('me', errors = False)
+        return self._user(self.user_id, self.screen_name)
+
+    def home_timeline(self, since_id = None, count = 20, **kwargs):
+        self._call('home_timeline')
+        with self._lock:
+            return _newest(self._timeline, since_id, count)
+
+    def mentions_timeline(self, since_id = None, count = 20, **kwargs):
+        self._call('mentions_timeline')
+        with self._lock:
+            return _newest(self._mentions, since_id, count)
+
+    def followers_ids(self, user_id = None, cursor = -1, **kwargs):
+        self._call('followers_ids')
+        with self._lock:
+            return _page(self._followers, cursor)
+    followers_ids.pagination_mode = 'cursor'
+
+    def friends_ids(self, user_id = None, cursor = -1, **kwargs):
+        self._call('friends_ids')
+        with self._lock:
+            return _page(self._friends, cursor)
+    friends_ids.pagination_mode = 'cursor'
+
+    def get_user(self, id = None, user_id = None, screen_name = None, **kwargs):
+        self._call('get_user')
+        uid = user_id or id or 1000
+        return self._user(uid, screen_name or 'user%s' % uid)
+
+    def lookup_users(self, user_ids = None, **kwargs):
+        self._call('lookup_users')
+        return [self._user(i, 'user%s' % i) for i in (user_ids or [])]
+
+    def update_status(self, status = None, in_reply_to_status_id = None, **kwargs):
+        self._call('update_status')
+        return self._status(self.user_id, self.screen_name, status)
+
+    def create_favorite(self, id, **kwargs):
+        self._call('create_favorite')
+
+    def create_friendship(self, id = None, user_id = None, **kwargs):
+        self._call('create_friendship')
+        with self._lock:
+            self._friends.add(user_id or id)
+
+    def retweet(self, id, **kwargs):
+        self._call('retweet')
+
+    # # # # # # # # # # # # # # # # # # # # # # #
+    #          The streaming API, etc.          #
+    # # # # # # # # # # # # # # # # # # # # # # #
+
+    def stream(self, listener):
+        """
+        Stream factory: makes a SimulatedStream delivering statuses to
+        `listener.on_status`.
+        """
+        return SimulatedStream(self, listener)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the number of API `calls`, `errors` and `rate_limited`
+        calls, each by endpoint, and the number of statuses `streamed`.
+        """
+        with self._lock:
+            return {
+                'calls': dict(self.calls),
+                'errors': dict(self.errors),
+                'rate_limited': dict(self.rate_limited),
+                'streamed': self.streamed,
+            }
+
+    def run_bot(self, bot, duration):
+        """
+        Runs `bot` (which must be using this backend) for `duration`
+        seconds, then stops it.
+
+        Returns
+        -------
+        Dict with the bot's `action_stats()` and `buffer_stats()` (under
+        `actions` and `buffer`), and this backend's `stats()` (under
+        `twitter`).
+        """
+        thread = threading.Thread(target = bot.run, name = 'pybot-simulated')
+        thread.daemon = True
+        thread.start()
+        time.sleep(duration)
+        bot.running = False
+        bot._wakeup.set()
+        if bot.stream.running:
+            bot.stream.disconnect()
+        thread.join(duration + 5)
+        return {'actions': bot.action_stats(), 'buffer': bot.buffer_stats(), 'twitter': self.stats()}
+
+    def _call(self, endpoint, errors = True):
+        """
+        Simulates the round trip of a call: waits out the latency, applies
+        the rate limit window, maybe fails, and advances the world.
+        """
+        if self.latency > 0:
+            time.sleep(self._random.expovariate(1.0 / self.latency))
+
+        now = time.time()
+        with self._lock:
+            self.calls[endpoint] += 1
+            headers = {}
+            limit = self.rate_limits.get(endpoint)
+            if limit is not None:
+                calls, period = limit
+                start, used = self._windows.get(endpoint, (now, 0))
+                if now >= start + period:
+                    start, used = now, 0
+                used += 1
+                self._windows[endpoint] = (start, used)
+                headers = {
+                    'x-rate-limit-limit': str(calls),
+                    'x-rate-limit-remaining': str(max(0, calls - used)),
+                    'x-rate-limit-reset': str(int(start + period)),
+                }
+                if used > calls:
+                    self.rate_limited[endpoint] += 1
+                    self.last_response = _Response(429, headers)
+                    raise tweepy.RateLimitError("Rate limit exceeded (simulated).", self.last_response)
+
+            if errors and self._random.random() < self.error_rate:
+                self.errors[endpoint] += 1
+                self.last_response = _Response(503, headers)
+                raise tweepy.TweepError("Over capacity (simulated).", self.last_response, api_code = 130)
+
+            self.last_response = _Response(200, headers)
+            self._advance(now)
+
+    def _advance(self, now):
+        """
+        Moves the world on to `now`: new timeline tweets, mentions and
+        follower changes since the last call.
+        """
+        elapsed = now - self._updated
+        self._updated = now
+        friends = list(self._friends)
+        for _ in range(self._events(self.timeline_rate * elapsed)):
+            uid = self._random.choice(friends) if len(friends) > 0 else 1000
+            self._timeline.append(self._status(uid, 'user%s' % uid, self._text()))
+        for _ in range(self._events(self.mention_rate * elapsed)):
+            uid = self._random.randrange(1000, 1000 + self.users)
+            self._mentions.append(self._status(uid, 'user%s' % uid, '@%s %s' % (self.screen_name, self._text())))
+        for _ in range(self._events(self.follow_rate * elapsed)):
+            self._followers.add(self._random.randrange(1000, 1000 + self.users))
+        for _ in range(self._events(self.unfollow_rate * elapsed)):
+            if len(self._followers) > 0:
+                self._followers.discard(self._random.choice(tuple(self._followers)))
+
+    def _events(self, expected):
+        """
+        Rounds an expected number of events up or down at random, so that
+        fractional rates add up over many calls.
+        """
+        n = int(expected)
+        return n + (1 if self._random.random() < expected - n else 0)
+
+    def _text(self, track = ()):
+        words = [self._random.choice(_WORDS) for _ in range(self._random.randint(4, 16))]
+        if len(track) > 0:
+            words.insert(self._random.randrange(len(words)), self._random.choice(track))
+        return ' '.join(words)
+
+    def _user(self, uid, screen_name):
+        return tweepy.User.parse(None, {
+            'id': uid,
+            'id_str': str(uid),
+            'screen_name': screen_name,
+            'followers_count': self._random.randint(0, 5000),
+            'friends_count': self._random.randint(0, 1000),
+        })
+
+    def _status(self, uid, screen_name, text):
+        tid = next(self._ids)
+        return tweepy.Status.parse(None, {
+            'id': tid,
+            'id_str': str(tid),
+            'text': text,
+            'lang': 'en',
+            'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime()),
+            'in_reply_to_screen_name': None,
+            'user': {
+                'id': uid,
+                'id_str': str(uid),
+                'screen_name': screen_name,
+                'followers_count': self._random.randint(0, 5000),
+            },
+        })
+
+def sweep(make_bot, settings, duration = 30, max_lag = 1.0):
+    """
+    Load tests a bot configuration under increasing load, to find where it
+    stops keeping up.
+
+    Parameters
+    ----------
+    make_bot : callable
+        Takes a SimulatedTwitter and returns a new bot using it, e.g.
+        `lambda sim: MyBot(api_client = sim, stream_factory = sim.stream)`.
+    settings : list of dicts
+        SimulatedTwitter arguments for each step, from lightest to heaviest
+        load, e.g. `[{'stream_rate': r} for r in (100, 1000, 10000)]`.
+    duration : float
+        Number of seconds to run each step for.
+    max_lag : float
+        Most an action may start late, in seconds, before the bot is
+        considered to be missing its intervals.
+
+    Returns
+    -------
+    List of results from `SimulatedTwitter.run_bot`, one per step, each
+    with the step's `settings` and whether the bot was `ok`: no action
+    started more than `max_lag` late and no buffered status was dropped.
+    Stops after the first step that isn't ok.
+    """
+    results = []
+    for kwargs in settings:
+        sim = SimulatedTwitter(**kwargs)
+        result = sim.run_bot(make_bot(sim), duration)
+        lag = max([a['max_lag'] for a in result['actions'].values()] or [0.0])
+        result['settings'] = kwargs
+        result['ok'] = lag <= max_lag and result['buffer']['dropped'] == 0
+        logging.info("Load test %s: max lag %.3fs, %s dropped." % (kwargs, lag, result['buffer']['dropped']))
+        results.append(result)
+        if not result['ok']:
+            break
+    return results
+
+class SimulatedStream(object):
+    """
+    Stand-in for tweepy.Stream, fed by a SimulatedTwitter. Once started,
+    a background thread delivers statuses to the listener at the backend's
+    `stream_rate`, including any tracked keywords in their text.
+    """
+
+    def __init__(self, twitter, listener):
+        self.twitter = twitter
+        self.listener = listener
+        self.running = False
+        self._thread = None
+
+    def filter(self, track = None, languages = None, is_async = False, **kwargs):
+        self._start(tuple(track or ()), is_async)
+
+    def sample(self, languages = None, is_async = False, **kwargs):
+        self._start((), is_async)
+
+    def disconnect(self):
+        self.running = False
+
+    def _start(self, track, is_async):
+        self.running = True
+        if not is_async:
+            self._run(track)
+            return
+        self._thread = threading.Thread(target = self._run, args = (track,), name = 'pybot-simulated-stream')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, track):
+        """
+        Delivers statuses in 10ms ticks, catching up if the listener falls
+        behind, until disconnected.
+        """
+        twitter = self.twitter
+        logging.info("Simulated stream started at %s statuses per second." % twitter.stream_rate)
+        start = time.time()
+        sent = 0
+        while self.running:
+            due = int((time.time() - start) * twitter.stream_rate)
+            for _ in range(due - sent):
+                uid = twitter._random.randrange(1000, 1000 + twitter.users)
+                self.listener.on_status(twitter._status(uid, 'user%s' % uid, twitter._text(track)))
+            with twitter._lock:
+                twitter.streamed += due - sent
+            sent = due
+            time.sleep(0.01)
+
+class _Response(object):
+    """
+    The parts of a requests.Response that PyBot looks at.
+    """
+
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+def _newest(tweets, since_id, count):
+    """
+    Lists up to `count` of `tweets` newer than `since_id`, newest first.
+    """
+    newer = [t for t in tweets if since_id is None or t.id > since_id]
+    return list(reversed(newer))[:count]
+
+def _page(ids, cursor, size = 5000):
+    """
+    Returns one page of an IDs listing, with (previous, next) cursors.
+    """
+    ids = sorted(ids)
+    start = 0 if cursor == -1 else cursor
+    end = start + size
+    return ids[start:end], (start, end if end < len(ids) else 0)
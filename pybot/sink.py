@@ -0,0 +1,218 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class JsonlSink(object):
+    """
+    Writes records to disk as JSON lines, for mining the stream.
+
+    Records are encoded by `write` and batched in memory; a background
+    thread appends each batch to the current file once `flush_records`
+    have piled up or `flush_interval` seconds have passed, so `write`
+    never waits on the disk. Files can be rotated by size or by the hour,
+    and compressed with gzip or, if the zstandard package is installed,
+    zstd.
+    """
+
+    def __init__(self, path = 'tweets.jsonl', flush_records = 1000, flush_interval = 5, max_bytes = 0,
+            hourly = False, compression = None, max_pending = 100000):
+        """
+        Parameters
+        ----------
+        path : string
+            File to write to. When rotating or compressing, this is a
+            template: each file gets a timestamp inserted before the
+            extension, e.g. "tweets-20170101-120000.jsonl.gz".
+        flush_records : integer
+            Number of pending records that triggers a flush.
+        flush_interval : float
+            Maximum number of seconds between flushes.
+        max_bytes : integer
+            Start a new file once this many (uncompressed) bytes have been
+            written to the current one. 0 for no limit.
+        hourly : boolean
+            If True, start a new file every hour.
+        compression : string
+            None, 'gzip' or 'zstd'.
+        max_pending : integer
+            Maximum number of records waiting to be flushed. Records written
+            past this are dropped, rather than blocking the caller.
+        """
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError("Unknown compression '%s'." % compression)
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package.")
+        self.path = path
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.hourly = hourly
+        self.compression = compression
+        self.max_pending = max_pending
+
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.files = []
+
+        self._pending = []
+        self._file = None
+        self._file_bytes = 0
+        self._file_hour = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target = self._run, name = 'JsonlSink')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """
+        Queues a record to be written.
+
+        Parameters
+        ----------
+        record : dict
+            Anything json.dumps can encode.
+
+        Returns
+        -------
+        False if the record was dropped because too many are pending, True
+        otherwise.
+        """
+        line = json.dumps(record)
+        with self._cond:
+            if self._closed:
+                raise ValueError("Writing to a closed JsonlSink.")
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(line)
+            if len(self._pending) >= self.flush_records:
+                self._cond.notify()
+        return True
+
+    def flush(self):
+        """
+        Asks the background thread to write out everything pending now.
+        """
+        with self._cond:
+            self._cond.notify()
+
+    def close(self):
+        """
+        Writes out everything pending and closes the current file.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the number of records `written`, `pending` and `dropped`,
+        the number of `flushes`, and the `files` written so far.
+        """
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'written': self.written,
+            'pending': pending,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'files': list(self.files),
+        }
+
+    def _run(self):
+        """
+        Background thread: waits for a batch, then writes it.
+        """
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.flush_records:
+                    self._cond.wait(self.flush_interval)
+                batch = self._pending
+                self._pending = []
+                closed = self._closed
+            if len(batch) > 0:
+                try:
+                    self._write(batch)
+                except (IOError, OSError) as e:
+                    logging.error("Unable to write %s records to %s: %s" % (len(batch), self.path, e))
+            if closed:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _write(self, batch):
+        """
+        Appends a batch of encoded records to the current file, rotating it
+        first if it's due.
+        """
+        data = ('\n'.join(batch) + '\n').encode('utf8')
+        hour = time.strftime('%Y%m%d%H') if self.hourly else None
+        if self._file is not None and ((self.hourly and hour != self._file_hour) or
+                (self.max_bytes > 0 and self._file_bytes + len(data) > self.max_bytes and self._file_bytes > 0)):
+            self._file.close()
+            self._file = None
+        if self._file is None:
+            self._open()
+            self._file_hour = hour
+        self._file.write(data)
+        self._file.flush()
+        self._file_bytes += len(data)
+        self.written += len(batch)
+        self.flushes += 1
+
+    def _open(self):
+        """
+        Opens the next file to write to.
+        """
+        path = self.path
+        if self.hourly or self.max_bytes > 0 or self.compression is not None:
+            root, ext = os.path.splitext(self.path)
+            stamp = '%s-%s' % (root, time.strftime('%Y%m%d-%H%M%S'))
+            suffix = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[self.compression]
+            path = '%s%s%s' % (stamp, ext, suffix)
+            n = 1
+            while os.path.exists(path):
+                path = '%s.%s%s%s' % (stamp, n, ext, suffix)
+                n += 1
+
+        if self.compression == 'gzip':
+            self._file = gzip.open(path, 'ab')
+        elif self.compression == 'zstd':
+            self._file = zstandard.ZstdCompressor().stream_writer(open(path, 'ab'))
+        else:
+            self._file = open(path, 'ab')
+        self._file_bytes = 0
+        self.files.append(path)
+        logging.info("Writing records to %s." % path)
@@ -0,0 +1,239 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+import weakref
+
+from .buffer import RingBuffer
+
+class SpillBuffer(object):
+    """
+    FIFO buffer that, rather than dropping items once it's full, spills the
+    overflow to disk. Items are kept in memory up to `capacity` and
+    `max_bytes`; past that, they're pickled onto memory-mapped, append-only
+    segment files and read back, in order, when the buffer is iterated.
+
+    Has the same interface as RingBuffer. Segment files are deleted when the
+    buffer is cleared or garbage collected.
+    """
+
+    def __init__(self, capacity, max_bytes = 0, directory = None, segment_bytes = 16 * 1024 * 1024,
+            max_spill_bytes = 0):
+        """
+        Parameters
+        ----------
+        capacity : integer
+            Maximum number of items kept in memory.
+        max_bytes : integer
+            Maximum total size of the items kept in memory, or 0 for no limit.
+        directory : string
+            Where to put the segment files. Defaults to the system's temporary
+            directory.
+        segment_bytes : integer
+            Size of each segment file.
+        max_spill_bytes : integer
+            Maximum total size of the spilled items, or 0 for no limit. Once
+            reached, new items are dropped.
+        """
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_spill_bytes = max_spill_bytes
+        self.dropped = 0
+        self.peak = 0
+        self._memory = RingBuffer(capacity, max_bytes)
+        self._segments = []
+        self._spilled = 0
+        self._finalizer = weakref.finalize(self, _close_segments, self._segments)
+
+    @property
+    def nbytes(self):
+        return self._memory.nbytes
+
+    @property
+    def spilled(self):
+        """
+        Number of items on disk.
+        """
+        return self._spilled
+
+    @property
+    def spill_bytes(self):
+        """
+        Total size of the items on disk, in bytes.
+        """
+        return sum(s.end for s in self._segments)
+
+    def __len__(self):
+        return len(self._memory) + self._spilled
+
+    def __iter__(self):
+        """
+        Iterates from the oldest item to the newest.
+        """
+        for item in self._memory:
+            yield item
+        for segment in list(self._segments):
+            for item in segment:
+                yield item
+
+    def __reversed__(self):
+        """
+        Iterates from the newest item to the oldest.
+        """
+        for segment in reversed(list(self._segments)):
+            for item in reversed(segment):
+                yield item
+        for item in reversed(self._memory):
+            yield item
+
+    def append(self, item, nbytes = 0):
+        """
+        Adds an item to the buffer, spilling it to disk if the in-memory part
+        is full. Once anything has been spilled, later items are spilled too,
+        so that they stay in order.
+
+        Parameters
+        ----------
+        item : object
+            Item to add. Must be picklable.
+        nbytes : integer
+            Size of the item, counted against `max_bytes`.
+
+        Returns
+        -------
+        True if the item had to be dropped, False otherwise.
+        """
+        if self._spilled == 0 and self._has_room(nbytes):
+            self._memory.append(item, nbytes)
+        else:
+            data = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+            if self.max_spill_bytes > 0 and self.spill_bytes + len(data) > self.max_spill_bytes:
+                self.dropped += 1
+                return True
+            if len(self._segments) == 0 or not self._segments[-1].append(data):
+                segment = _Segment(max(self.segment_bytes, len(data)), self.directory)
+                self._segments.append(segment)
+                segment.append(data)
+            self._spilled += 1
+
+        if len(self) > self.peak:
+            self.peak = len(self)
+        return False
+
+    def clear(self):
+        """
+        Empties the buffer and deletes its segment files. Counters are left
+        untouched.
+        """
+        self._memory.clear()
+        _close_segments(self._segments)
+        self._spilled = 0
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the same keys as `RingBuffer.stats()`, where `length`
+        counts spilled items too, plus the number of items `spilled` to disk
+        and the `spill_bytes` they take up.
+        """
+        stats = self._memory.stats()
+        stats.update({
+            'length': len(self),
+            'dropped': self.dropped,
+            'peak': self.peak,
+            'spilled': self._spilled,
+            'spill_bytes': self.spill_bytes,
+        })
+        return stats
+
+    def _has_room(self, nbytes):
+        """
+        True if an item of size `nbytes` fits in memory.
+        """
+        if len(self._memory) == 0:
+            return True
+        if len(self._memory) == self.capacity:
+            return False
+        return self.max_bytes == 0 or self._memory.nbytes + nbytes <= self.max_bytes
+
+class _Segment(object):
+    """
+    Fixed-size, memory-mapped file that pickled items are appended to.
+    """
+
+    def __init__(self, size, directory = None):
+        fd, self.path = tempfile.mkstemp(prefix = 'pybot-spill-', suffix = '.seg', dir = directory)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.end = 0
+        self._offsets = array.array('Q')
+        logging.debug("Spilling streamed statuses to %s." % self.path)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        for i in range(len(self._offsets)):
+            yield self._load(i)
+
+    def __reversed__(self):
+        for i in range(len(self._offsets) - 1, -1, -1):
+            yield self._load(i)
+
+    def append(self, data):
+        """
+        Writes `data` at the end of the segment.
+
+        Returns
+        -------
+        False if it doesn't fit, True otherwise.
+        """
+        if self.end + len(data) > self.size:
+            return False
+        self._map[self.end:self.end + len(data)] = data
+        self._offsets.append(self.end)
+        self.end += len(data)
+        return True
+
+    def close(self):
+        """
+        Unmaps and deletes the file.
+        """
+        self._map.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _load(self, i):
+        start = self._offsets[i]
+        stop = self._offsets[i + 1] if i + 1 < len(self._offsets) else self.end
+        return pickle.loads(self._map[start:stop])
+
+def _close_segments(segments):
+    for segment in segments:
+        segment.close()
+    del segments[:]
@@ -0,0 +1,154 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+class State(dict):
+    """
+    Dictionary that keeps track of which of its keys changed since it was
+    last saved, so PyBot can skip saving when nothing did.
+
+    Assigning or deleting a key is tracked automatically. Changing a value
+    in place, e.g. `state['hits'].append(x)`, is not; call `touch(key)`
+    afterwards. Sets of IDs such as `friends` and `followers` are best
+    changed with `add_ids` and `remove_ids`, which also log which IDs
+    changed, so storage that supports it can write just those.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(State, self).__init__(*args, **kwargs)
+        self.dirty_keys = set(self.keys())
+        self.id_changes = {}
+
+    @property
+    def dirty(self):
+        """
+        True if anything changed since the last `clean()`.
+        """
+        return len(self.dirty_keys) > 0
+
+    def touch(self, key):
+        """
+        Marks `key` as changed.
+        """
+        self._changed(key)
+
+    def add_ids(self, key, ids):
+        """
+        Adds `ids` to the set under `key`, logging them as added.
+        """
+        ids = list(ids)
+        self[key].update(ids)
+        changes = self._id_log(key)
+        if changes is not None:
+            changes[0].update(ids)
+            changes[1].difference_update(ids)
+
+    def remove_ids(self, key, ids):
+        """
+        Removes `ids` from the set under `key`, logging them as removed.
+        """
+        ids = list(ids)
+        self[key].difference_update(ids)
+        changes = self._id_log(key)
+        if changes is not None:
+            changes[1].update(ids)
+            changes[0].difference_update(ids)
+
+    def clean(self):
+        """
+        Marks everything as saved.
+        """
+        self.dirty_keys = set()
+        self.id_changes = {}
+
+    def take_changes(self):
+        """
+        Marks everything as saved, handing back what had changed, so that
+        changes made while a save is in progress count towards the next.
+
+        Returns
+        -------
+        (dirty_keys, id_changes), as they were.
+        """
+        changes = (self.dirty_keys, self.id_changes)
+        self.clean()
+        return changes
+
+    def restore_changes(self, dirty_keys, id_changes):
+        """
+        Puts back changes taken by `take_changes`, e.g. when saving failed,
+        merging them with any made since.
+        """
+        for key in dirty_keys:
+            old = id_changes.get(key)
+            new = self.id_changes.get(key)
+            if old is None or (key in self.dirty_keys and new is None):
+                # Changed as a whole, before or since.
+                self._changed(key)
+            elif new is None:
+                self.dirty_keys.add(key)
+                self.id_changes[key] = old
+            else:
+                # Later changes win over earlier ones.
+                new[0].update(old[0] - new[1])
+                new[1].update(old[1] - new[0])
+
+    def _id_log(self, key):
+        """
+        The (added, removed) log of `key`, marking it as changed. None if
+        the key was already changed in some other way since the last save,
+        so it has to be written in full anyway.
+        """
+        if key in self.dirty_keys and key not in self.id_changes:
+            return None
+        self.dirty_keys.add(key)
+        return self.id_changes.setdefault(key, (set(), set()))
+
+    def __setitem__(self, key, value):
+        super(State, self).__setitem__(key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        super(State, self).__delitem__(key)
+        self._changed(key)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key in self:
+            self._changed(key)
+        return super(State, self).pop(key, *default)
+
+    def popitem(self):
+        key, value = super(State, self).popitem()
+        self._changed(key)
+        return key, value
+
+    def clear(self):
+        for key in self.keys():
+            self._changed(key)
+        super(State, self).clear()
+
+    def _changed(self, key):
+        """
+        Marks `key` as changed as a whole.
+        """
+        self.dirty_keys.add(key)
+        self.id_changes.pop(key, None)
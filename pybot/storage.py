@@ -15,6 +15,10 @@ limitations under the License.
 import logging
 import os
 import pickle
+import sqlite3
+import threading
+
+from .idset import IdSet
 
 class PickleStorage(object):
     """
@@ -62,6 +66,239 @@ class PickleStorage(object):
             logging.info("Overwriting %s." % f)
         else:
             logging.info("Creating %s." % f)
-        fp = open(f, "wb")
-        pickle.dump(s, fp)
+
+        # Write to a temporary file and swap it in, so a crash mid-write
+        # leaves the previous state intact.
+        tmp = "%s.tmp" % f
+        fp = open(tmp, "wb")
+        pickle.dump(dict(s), fp)
+        fp.flush()
+        os.fsync(fp.fileno())
         fp.close()
+        os.replace(tmp, f)
+        _fsync_dir(f)
+
+class SQLiteStorage(object):
+    """
+    Storage class backed by an SQLite database in WAL mode.
+
+    Each top-level key of the state is its own row, and only the keys that
+    changed since the last save are rewritten. Sets of user IDs (by default
+    `friends` and `followers`) are stored apart: an IdSet as a single
+    packed BLOB, which is loaded back without copying, and a Python set in
+    an indexed table. If the state logged which IDs were added or removed
+    (see `State.add_ids`), just those are written: for a set, as rows
+    inserted or deleted; for an IdSet, as rows of a change table applied
+    on load, until they amount to a tenth of the set (or 1000 IDs, if more)
+    and the BLOB is rewritten with them folded in.
+
+    The database sits next to the pickle file PyBot asks for, e.g.
+    "MyBot_state.db" for "MyBot_state.pkl". If the database doesn't exist
+    yet but the pickle file does, the pickled state is migrated into it.
+    """
+
+    # PyBot passes this storage the keys and IDs that changed.
+    incremental = True
+
+    def __init__(self, path = None, id_keys = ('friends', 'followers')):
+        """
+        Parameters
+        ----------
+        path : string or None
+            Path to the database. If None, derived from the path PyBot uses
+            for its state file.
+        id_keys : tuple of strings
+            State keys holding sets of integer IDs.
+        """
+        self.path = path
+        self.id_keys = frozenset(id_keys)
+        self._conn = None
+        self._conn_path = None
+        self._keys = set()
+        self._packed = set()
+        self._deltas = {}
+        self._lock = threading.Lock()
+
+    def read(self, f):
+        """
+        Read method.
+
+        Parameters
+        ----------
+        f : string
+            Path to the .pkl state file; see `path` in the constructor.
+
+        Returns
+        -------
+        PyBot state dictionary if the database or pickle file exists; None
+        otherwise.
+        """
+        db = self._db_path(f)
+        if not os.path.exists(db):
+            s = PickleStorage().read(f)
+            if s is not None:
+                logging.info("Migrating state from %s to %s." % (f, db))
+                self.write(f, s)
+            return s
+
+        logging.info("Retrieving state from %s." % db)
+        with self._lock:
+            conn = self._connect(db)
+            state = {}
+            for key, value in conn.execute("SELECT key, value FROM state"):
+                state[key] = pickle.loads(value)
+                self._keys.add(key)
+            packed = dict(conn.execute("SELECT key, ids FROM idsets"))
+            self._packed = set(packed)
+            for key in self.id_keys:
+                if key in packed:
+                    state[key] = ids = IdSet.frombuffer(packed[key])
+                    rows = conn.execute("SELECT id, added FROM iddeltas WHERE key = ?", (key,)).fetchall()
+                    if len(rows) > 0:
+                        ids.update([i for i, added in rows if added])
+                        ids.difference_update([i for i, added in rows if not added])
+                    self._deltas[key] = len(rows)
+                elif key in state:
+                    state[key] = set(r[0] for r in conn.execute("SELECT id FROM ids WHERE key = ?", (key,)))
+        return state
+
+    def write(self, f, s, dirty = None, id_changes = None):
+        """
+        Write method.
+
+        Parameters
+        ----------
+        f : string
+            Path to the .pkl state file; see `path` in the constructor.
+        s : dictionary
+            Dict containing this PyBot's current state.
+        dirty : set or None
+            Keys that changed since the last write. If None, every key is
+            written.
+        id_changes : dict or None
+            For keys in `id_keys` whose set was only added to or removed
+            from, an (added, removed) pair of ID sets, as logged by State.
+        """
+        db = self._db_path(f)
+        if dirty is None:
+            id_changes = None
+        if id_changes is None:
+            id_changes = {}
+        with self._lock:
+            conn = self._connect(db)
+            keys = set(s) | self._keys if dirty is None else dirty
+            with conn:
+                changed = 0
+                for key in keys:
+                    if key not in s:
+                        if key in self._keys:
+                            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+                            conn.execute("DELETE FROM ids WHERE key = ?", (key,))
+                            conn.execute("DELETE FROM idsets WHERE key = ?", (key,))
+                            conn.execute("DELETE FROM iddeltas WHERE key = ?", (key,))
+                            self._keys.discard(key)
+                            self._packed.discard(key)
+                            self._deltas.pop(key, None)
+                            changed += 1
+                        continue
+
+                    value = s[key]
+                    if key in self.id_keys:
+                        changed += self._write_ids(conn, key, value, id_changes.get(key))
+                        if key in self._keys:
+                            continue
+                        # Store a placeholder row so the key exists on read.
+                        value = None
+                    blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                    conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, blob))
+                    self._keys.add(key)
+                    changed += 1
+        logging.info("Wrote %s changes to %s." % (changed, db))
+
+    def _write_ids(self, conn, key, ids, changes):
+        """
+        Writes the ID set for `key`: just the logged `changes` if there are
+        any (and, for an IdSet, not too many piled up already), or else all
+        of it.
+
+        Returns
+        -------
+        Number of rows written or deleted.
+        """
+        if isinstance(ids, IdSet):
+            if changes is not None and key in self._packed:
+                added, removed = changes
+                deltas = self._deltas.get(key, 0) + len(added) + len(removed)
+                if deltas <= max(1000, len(ids) // 10):
+                    conn.executemany("INSERT OR REPLACE INTO iddeltas (key, id, added) VALUES (?, ?, 1)",
+                        ((key, i) for i in added))
+                    conn.executemany("INSERT OR REPLACE INTO iddeltas (key, id, added) VALUES (?, ?, 0)",
+                        ((key, i) for i in removed))
+                    self._deltas[key] = deltas
+                    return len(added) + len(removed)
+            conn.execute("INSERT OR REPLACE INTO idsets (key, ids) VALUES (?, ?)", (key, ids.tobytes()))
+            conn.execute("DELETE FROM ids WHERE key = ?", (key,))
+            conn.execute("DELETE FROM iddeltas WHERE key = ?", (key,))
+            self._packed.add(key)
+            self._deltas[key] = 0
+            return 1
+
+        # A set logged against a packed copy has to be written in full.
+        if changes is not None and key not in self._packed:
+            added, removed = changes
+            conn.executemany("DELETE FROM ids WHERE key = ? AND id = ?", ((key, i) for i in removed))
+        else:
+            added, removed = ids, ()
+            conn.execute("DELETE FROM ids WHERE key = ?", (key,))
+            conn.execute("DELETE FROM idsets WHERE key = ?", (key,))
+            conn.execute("DELETE FROM iddeltas WHERE key = ?", (key,))
+            self._packed.discard(key)
+            self._deltas.pop(key, None)
+        conn.executemany("INSERT OR IGNORE INTO ids (key, id) VALUES (?, ?)", ((key, i) for i in added))
+        return len(added) + len(removed)
+
+    def _db_path(self, f):
+        if self.path is not None:
+            return self.path
+        return '%s.db' % os.path.splitext(f)[0]
+
+    def _connect(self, db):
+        """
+        Opens (once) and initializes the database.
+        """
+        if self._conn is not None and self._conn_path == db:
+            return self._conn
+        if os.path.exists(db):
+            logging.info("Opening %s." % db)
+        else:
+            logging.info("Creating %s." % db)
+        conn = sqlite3.connect(db, check_same_thread = False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB)")
+        conn.execute("CREATE TABLE IF NOT EXISTS ids (key TEXT, id INTEGER, PRIMARY KEY (key, id)) WITHOUT ROWID")
+        conn.execute("CREATE TABLE IF NOT EXISTS idsets (key TEXT PRIMARY KEY, ids BLOB)")
+        conn.execute("CREATE TABLE IF NOT EXISTS iddeltas (key TEXT, id INTEGER, added INTEGER, "
+            "PRIMARY KEY (key, id)) WITHOUT ROWID")
+        conn.commit()
+        self._conn = conn
+        self._conn_path = db
+        self._keys = set()
+        self._packed = set()
+        self._deltas = {}
+        return conn
+
+def _fsync_dir(f):
+    """
+    Flushes the directory entry of `f` to disk, where the OS supports it.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(f)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,248 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import logging
+import signal
+import sys
+import threading
+import time
+
+from .pybot import AsyncPyBot
+from .scheduler import Scheduler
+
+class _BotFilter(logging.Filter):
+    """
+    Stamps each log record with the name of the bot whose action is running
+    on the current thread, as `%(bot)s`.
+    """
+
+    def __init__(self, context):
+        super(_BotFilter, self).__init__()
+        self.context = context
+
+    def filter(self, record):
+        record.bot = getattr(self.context, 'bot', '-')
+        return True
+
+class Supervisor(object):
+    """
+    Hosts many PyBots in a single process. All the bots share one scheduler,
+    one run loop (and optionally one worker pool), one log file and, unless
+    configured otherwise, one pool of HTTP connections. Each keeps its own
+    configuration, state and storage.
+
+    Bots are told apart by `config['bot_name']`, which must be unique. Their
+    own `logging_level` settings are ignored in favour of the supervisor's.
+    """
+
+    def __init__(self, logfile = 'pybot.log', logging_level = logging.DEBUG, worker_threads = 0):
+        """
+        Parameters
+        ----------
+        logfile : string
+            Path to the log file shared by all the bots.
+        logging_level : integer
+            Logging level for all the bots.
+        worker_threads : integer
+            Number of worker threads used to run due actions concurrently.
+            Set to 0 to run every action on the main thread.
+        """
+        self.bots = {}
+        self.scheduler = Scheduler()
+        self.worker_threads = worker_threads
+        self.running = False
+        self._wakeup = threading.Event()
+        self._context = threading.local()
+
+        # Set up the shared logging pipeline. This has to happen before any
+        # bots are created, or the first one would claim the root logger.
+        handler = logging.FileHandler(logfile)
+        handler.setFormatter(logging.Formatter('%(asctime)s | %(bot)s | %(levelname)s: %(message)s',
+            datefmt = '%m/%d/%Y %I:%M:%S %p'))
+        handler.addFilter(_BotFilter(self._context))
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(logging_level)
+
+    def add(self, bot):
+        """
+        Adds a bot to the supervisor. Any callbacks it has already registered
+        move to the shared scheduler.
+
+        Parameters
+        ----------
+        bot : PyBot or PyBot subclass
+            Bot instance, or a class to instantiate.
+
+        Returns
+        -------
+        The bot instance.
+        """
+        if isinstance(bot, type):
+            bot = bot()
+        if isinstance(bot, AsyncPyBot):
+            raise TypeError("AsyncPyBot '%s' runs its own event loop and can't be supervised." % bot.config['bot_name'])
+        name = bot.config['bot_name']
+        if name in self.bots:
+            raise ValueError("A bot named '%s' is already being supervised." % name)
+
+        view = self.scheduler.namespace(name)
+        for action in bot.scheduler.actions():
+            view.schedule(action.name, action.callback, action.interval, when = action.when)
+        bot.scheduler = view
+        bot._wakeup = self._wakeup
+        self.bots[name] = bot
+        logging.info("Supervising bot '%s'." % name)
+        return bot
+
+    def load(self, spec):
+        """
+        Imports a bot class and adds an instance of it.
+
+        Parameters
+        ----------
+        spec : string
+            "module:ClassName", e.g. "echobot:EchoBot".
+
+        Returns
+        -------
+        The bot instance.
+        """
+        module_name, _, class_name = spec.partition(':')
+        module = importlib.import_module(module_name)
+        return self.add(getattr(module, class_name))
+
+    def run(self):
+        """
+        Runs all the supervised bots until interrupted.
+        """
+        signal.signal(signal.SIGINT, self._handler)
+        for bot in self.bots.values():
+            bot.running = True
+            bot._schedule_actions()
+
+        executor = None
+        if self.worker_threads > 0:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.worker_threads)
+
+        self.running = True
+        while self.running:
+            self._wakeup.clear()
+            current_time = time.time()
+
+            # Run everything that has come due, across all the bots.
+            for action in self.scheduler.pop_due(current_time):
+                bot = self.bots[action.key[0]]
+                if bot._defer(action, current_time):
+                    continue
+                if executor is None:
+                    self._call(bot, self._dispatch, bot, action, current_time)
+                else:
+                    future = executor.submit(self._call, bot, action.callback)
+                    future.add_done_callback(
+                        lambda f, bot = bot, action = action, t = current_time: self._call(bot, bot._dispatch_done, f, action, t))
+
+            # Are there any more actions?
+            if not any(bot._has_actions() for bot in self.bots.values()):
+                logging.warn("No actions are set for any bot! Switching supervisor OFF.")
+                self.running = False
+            else:
+                # Save the current state of each bot.
+                for bot in self.bots.values():
+                    self._call(bot, self._save_state, bot)
+
+                # Sleep until the next action (or pending save) is due, or
+                # until a worker thread finishes an action and requeues it.
+                next_action = self.scheduler.next_time()
+                for bot in self.bots.values():
+                    save_time = bot._next_save_time()
+                    if save_time is not None and (next_action is None or save_time < next_action):
+                        next_action = save_time
+                if next_action is None:
+                    self._wakeup.wait()
+                elif current_time < next_action:
+                    logging.info("Sleeping for %.4f seconds." % (next_action - current_time))
+                    self._wakeup.wait(next_action - current_time)
+
+        if executor is not None:
+            executor.shutdown(wait = True)
+        logging.info("---SHUTDOWN---")
+
+    def _dispatch(self, bot, action, current_time):
+        """
+        Runs a bot's due action on the main thread and puts it back in the
+        queue for its next run. A failing action is logged, as in worker
+        mode, rather than taking down every other bot.
+        """
+        try:
+            action.callback()
+        except Exception as e:
+            logging.error("Action %s failed: %s" % (action.name, e))
+        bot._reschedule(action, current_time)
+
+    def _save_state(self, bot):
+        """
+        Saves a bot's state, logging rather than raising any failure.
+        """
+        try:
+            bot._save_state()
+        except Exception as e:
+            logging.error("Unable to save state: %s" % e)
+
+    def _call(self, bot, function, *args):
+        """
+        Calls `function` with log records attributed to `bot`.
+        """
+        self._context.bot = bot.config['bot_name']
+        try:
+            return function(*args)
+        finally:
+            self._context.bot = '-'
+
+    def _handler(self, signum, frame):
+        """
+        Signal handler. Gracefully exits every bot.
+        """
+        logging.info("SIGINT caught, shutting down.")
+        self.running = False
+        for bot in self.bots.values():
+            bot.running = False
+            if bot.stream.running:
+                bot.stream.disconnect()
+            if bot.writes is not None:
+                bot.writes.stop(timeout = 5)
+            self._call(bot, bot._save_state, True)
+        sys.exit()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Runs several PyBots in one process.",
+        epilog = "Example: python -m pybot.supervisor echobot:EchoBot miner:Miner")
+    parser.add_argument("bots", nargs = "+",
+        help = "Bots to run, each as module:ClassName.")
+    parser.add_argument("--logfile", default = "pybot.log",
+        help = "Log file shared by all the bots. [DEFAULT: pybot.log]")
+    parser.add_argument("--workers", type = int, default = 0,
+        help = "Number of worker threads for running actions. [DEFAULT: 0]")
+    args = parser.parse_args()
+
+    supervisor = Supervisor(logfile = args.logfile, worker_threads = args.workers)
+    for spec in args.bots:
+        supervisor.load(spec)
+    supervisor.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import contextlib
+import functools
+import itertools
+import logging
+import threading
+
+import requests
+import requests.adapters
+import urllib3.connectionpool
+
+class Transport(object):
+    """
+    HTTP transport for Twitter's REST API: one requests.Session over a pool
+    of persistent keep-alive connections, which any number of bots in the
+    same process can share.
+
+    Also counts how many requests each pooled connection has carried, so
+    you can see how often connection setup is being avoided.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, pool_connections = 4, pool_maxsize = 16, timeout = 60, max_retries = 0):
+        """
+        Parameters
+        ----------
+        pool_connections : integer
+            Number of per-host connection pools to keep.
+        pool_maxsize : integer
+            Number of connections to keep open per host.
+        timeout : float
+            Timeout for each request, in seconds.
+        max_retries : integer
+            Number of times to retry a failed connection.
+        """
+        self.timeout = timeout
+        self._connections = {}
+        self._serials = itertools.count()
+        self._lock = threading.Lock()
+
+        adapter = _CountingAdapter(self, pool_connections = pool_connections,
+            pool_maxsize = pool_maxsize, max_retries = max_retries)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def default(cls):
+        """
+        The process-wide Transport, created on first use.
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def attach(self, api):
+        """
+        Routes a tweepy.API's requests through this transport.
+
+        tweepy 4 keeps a session on each API object, which is replaced.
+        tweepy 3 builds a new session for every call and tinkers with its
+        headers and parameters before closing it again, so calls can't share
+        one; there, the API is wrapped so that each of its calls gets a
+        session of its own, over this transport's pool of connections.
+
+        Returns
+        -------
+        The API object to use from now on.
+        """
+        api.timeout = self.timeout
+        if hasattr(api, 'session'):
+            api.session = self.session
+            return api
+        _install_session_factory()
+        return _TransportAPI(api, self)
+
+    def stats(self):
+        """
+        Returns
+        -------
+        Dict with the number of `connections` opened, `requests` made and
+        `reused` (requests that didn't need a new connection), plus a
+        `per_connection` list of {'host', 'requests'} dicts.
+        """
+        with self._lock:
+            per_connection = [{'host': h, 'requests': n} for h, n in self._connections.values()]
+        requests_made = sum(c['requests'] for c in per_connection)
+        return {
+            'connections': len(per_connection),
+            'requests': requests_made,
+            'reused': requests_made - len(per_connection),
+            'per_connection': per_connection,
+        }
+
+    def _record(self, host, conn):
+        """
+        Counts a request made on `conn`.
+        """
+        with self._lock:
+            serial = getattr(conn, '_pybot_serial', None)
+            if serial is None:
+                serial = next(self._serials)
+                conn._pybot_serial = serial
+                self._connections[serial] = [host, 0]
+                logging.debug("Opened connection #%s to %s." % (serial, host))
+            self._connections[serial][1] += 1
+
+class _TransportAPI(object):
+    """
+    Wraps a tweepy 3 API object. tweepy binds a method, creating its
+    session, either on attribute lookup or inside the method itself; the
+    transport is made current for both, so the session handed out belongs
+    to it.
+    """
+
+    def __init__(self, api, transport):
+        self.api = api
+        self.transport = transport
+
+    def __getattr__(self, name):
+        with _using(self.transport):
+            attr = getattr(self.api, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with _using(self.transport):
+                return attr(*args, **kwargs)
+        return call
+
+class _CallSession(requests.Session):
+    """
+    Session for a single tweepy 3 call, mounted on its transport's shared
+    adapter. tweepy closes the session after every call; that must not
+    close the pooled connections, so `close()` does nothing.
+    """
+
+    def __init__(self, transport):
+        super(_CallSession, self).__init__()
+        adapter = transport.session.get_adapter('https://')
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def close(self):
+        pass
+
+class _SessionFactory(object):
+    """
+    Stands in for the requests module inside tweepy.binder. Hands out a
+    _CallSession if a transport is current in this thread, and an ordinary
+    Session (tweepy's own behaviour) otherwise.
+    """
+
+    def Session(self):
+        transport = getattr(_current, 'transport', None)
+        if transport is None:
+            return requests.Session()
+        return _CallSession(transport)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+# Transport whose API object is binding a method, per thread.
+_current = threading.local()
+
+@contextlib.contextmanager
+def _using(transport):
+    """
+    Makes `transport` current in this thread for the duration.
+    """
+    previous = getattr(_current, 'transport', None)
+    _current.transport = transport
+    try:
+        yield
+    finally:
+        _current.transport = previous
+
+def _install_session_factory():
+    """
+    Puts a _SessionFactory in tweepy.binder, once.
+    """
+    import tweepy.binder
+    if not isinstance(tweepy.binder.requests, _SessionFactory):
+        tweepy.binder.requests = _SessionFactory()
+
+def _counting_pool(base, transport):
+    """
+    Subclasses a urllib3 connection pool to report each request it makes.
+    """
+    class CountingPool(base):
+        def _make_request(self, conn, *args, **kwargs):
+            transport._record(self.host, conn)
+            return super(CountingPool, self)._make_request(conn, *args, **kwargs)
+    return CountingPool
+
+class _CountingAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools report to a Transport.
+    """
+
+    def __init__(self, transport, **kwargs):
+        self.transport = transport
+        super(_CountingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(_CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(urllib3.connectionpool.HTTPConnectionPool, self.transport),
+            'https': _counting_pool(urllib3.connectionpool.HTTPSConnectionPool, self.transport),
+        }
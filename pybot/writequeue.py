@@ -0,0 +1,183 @@
+"""
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+
+class _Write(object):
+    __slots__ = ('seq', 'function', 'args', 'future', 'dedupe')
+
+    def __init__(self, seq, function, args, future, dedupe):
+        self.seq = seq
+        self.function = function
+        self.args = args
+        self.future = future
+        self.dedupe = dedupe
+
+class WriteQueue(object):
+    """
+    Outbound queue for Twitter write calls, drained by a background thread.
+
+    Each endpoint has its own FIFO, and a write is only taken off it once
+    the rate governor has budget for its endpoint, so an endpoint that has
+    used up its budget doesn't hold up the others. Calls
+    carrying the same dedupe key (e.g. favorites of the same tweet) share a
+    single Future instead of hitting the API again, unless that call failed
+    (returned False or raised), in which case the next one is made.
+    """
+
+    def __init__(self, governor = None, dedupe_size = 10000):
+        """
+        Parameters
+        ----------
+        governor : pybot.ratelimit.RateGovernor or None
+            Governor whose budgets the writes wait for, normally the one the
+            writes' API calls go through. Endpoints it doesn't limit, or all
+            of them if None, are unlimited.
+        dedupe_size : integer
+            Number of dedupe keys to remember.
+        """
+        self.governor = governor
+        self.dedupe_size = dedupe_size
+        self._queues = collections.defaultdict(collections.deque)
+        self._dedupe = collections.OrderedDict()
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target = self._drain, name = 'pybot-writes')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __len__(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def submit(self, endpoint, function, args = (), dedupe = None):
+        """
+        Queues a write.
+
+        Parameters
+        ----------
+        endpoint : string
+            Name of the endpoint, for rate limiting.
+        function : function
+            Function that performs the write.
+        args : tuple
+            Arguments to `function`.
+        dedupe : hashable or None
+            If given, a write with the same key that is pending or recently
+            succeeded is not repeated; its Future is returned instead.
+
+        Returns
+        -------
+        concurrent.futures.Future holding the return value of `function`.
+        """
+        with self._cond:
+            if dedupe is not None and dedupe in self._dedupe:
+                logging.info("Skipping duplicate %s (%s)." % (endpoint, dedupe))
+                return self._dedupe[dedupe]
+
+            future = concurrent.futures.Future()
+            self._queues[endpoint].append(_Write(next(self._counter), function, args, future, dedupe))
+            if dedupe is not None:
+                self._dedupe[dedupe] = future
+                while len(self._dedupe) > self.dedupe_size:
+                    self._dedupe.popitem(last = False)
+            self._cond.notify()
+            return future
+
+    def stop(self, timeout = None):
+        """
+        Stops the drainer thread. Writes still queued are cancelled.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        with self._cond:
+            for q in self._queues.values():
+                while len(q) > 0:
+                    q.popleft().future.cancel()
+
+    def _ready_time(self, endpoint, now):
+        """
+        Earliest time the governor has budget for `endpoint`.
+        """
+        if self.governor is None:
+            return now
+        return now + self.governor.delay(endpoint)
+
+    def _next(self):
+        """
+        Pops the oldest write whose endpoint has budget.
+
+        Returns
+        -------
+        (write, None) if one is ready, or (None, seconds) to wait otherwise.
+        `seconds` is None if nothing is queued at all.
+        """
+        now = time.time()
+        best = None
+        wait = None
+        for endpoint, q in self._queues.items():
+            if len(q) == 0:
+                continue
+            ready = self._ready_time(endpoint, now)
+            if ready <= now:
+                if best is None or q[0].seq < self._queues[best][0].seq:
+                    best = endpoint
+            elif wait is None or ready - now < wait:
+                wait = ready - now
+        if best is None:
+            return None, wait
+        return self._queues[best].popleft(), None
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                write, wait = self._next()
+                while self._running and write is None:
+                    self._cond.wait(wait)
+                    write, wait = self._next()
+                if not self._running:
+                    if write is not None:
+                        write.future.cancel()
+                    return
+
+            if not write.future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = write.function(*write.args)
+            except Exception as e:
+                self._forget(write)
+                write.future.set_exception(e)
+            else:
+                if result is False:
+                    self._forget(write)
+                write.future.set_result(result)
+
+    def _forget(self, write):
+        """
+        Drops a failed write's dedupe key, so that the same write can be
+        tried again.
+        """
+        if write.dedupe is None:
+            return
+        with self._cond:
+            if self._dedupe.get(write.dedupe) is write.future:
+                del self._dedupe[write.dedupe]